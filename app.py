@@ -3,46 +3,153 @@
 # - Fixed logo loaded from /assets/logo.png (not shown in UI)
 # - Caption rendering with Pillow (no headless browser)
 # - FFmpeg always uses libx264 (CPU). No NVENC/GPU paths at all.
+# - Renders run on worker threads fed from a SQLite job store (leases, retries), so several
+#   gunicorn workers or containers can share the work; /render returns job IDs to poll. The
+#   source and render caches, output retention and metrics live in the same store.
+# - Bulk: POST /batch (JSON / JSON Lines manifest; poll /batch/<id>, or ?wait=1 for NDJSON
+#   results as they finish) or `python app.py batch`.
+#   GET /batch/<id>/bundle (or /jobs/bundle?ids=) streams the finished outputs as one ZIP.
+# - Drafts: POST /drafts?kind=still|clip for a quick layout check, then /drafts/<id>/approve.
+# - Admission control: per-client and queue limits (429 + Retry-After), source size/duration/
+#   resolution budgets, job cost predicted from recent encode speed.
+# - format=hls renders a 1080p/720p/480p HLS ladder (fMP4 segments, master playlist) in one
+#   ffmpeg run; its files are served from /preview/<name>.hls/... and download as a ZIP.
+# - gunicorn.conf.py preloads and warms the app (fonts, logo plate, ffmpeg check) before forking;
+#   each worker starts its own threads after the fork.
 # - Auto-cleans /outputs after TTL to keep disk small.
 
 from __future__ import annotations
 from pathlib import Path
-from flask import Flask, request, render_template_string, send_from_directory, flash
+from flask import Flask, request, render_template_string, flash, jsonify, url_for, abort, stream_with_context
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageDraw, ImageFont
-import subprocess, json, re, requests, tempfile, os, shutil, time, threading
-from urllib.parse import urlparse, parse_qs, urlencode
+from werkzeug.security import safe_join
+from werkzeug.http import is_resource_modified, dump_options_header
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+from PIL import Image, ImageDraw, ImageFont, PngImagePlugin, features
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache
+import subprocess, json, re, math, struct, zlib, sqlite3, fcntl, errno, socket, requests, requests.adapters, tempfile, os, shutil, time, threading, hashlib, unicodedata, resource, io, sys, argparse
+from urllib.parse import urlparse, parse_qs, urlencode, quote
 
 # -------------------- Paths & constants --------------------
 APP_DIR = Path(__file__).parent.resolve()
 ASSETS_DIR = APP_DIR / "assets"
 FONTS_DIR = ASSETS_DIR / "fonts"
 LOGO_PATH = str((ASSETS_DIR / "logo.png").resolve())         # fixed logo (hidden from UI)
-OUTPUTS_DIR = APP_DIR / "outputs"                            # public downloads
+OUTPUTS_DIR = Path(os.environ.get("OUTPUTS_DIR", APP_DIR / "outputs"))   # public downloads; shared volume for several nodes
 OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", APP_DIR / ".cache"))  # private derived data (indexes, caches)
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+SPOOL_DIR = Path(os.environ.get("SPOOL_DIR", CACHE_DIR / "spool"))   # uploads; share it (and JOB_DB) across nodes
+SPOOL_DIR.mkdir(parents=True, exist_ok=True)
 
 # online-friendly defaults
 OUT_W, OUT_H = 1080, 1920
 ACCENT = "#00BCD5"
+CAPTION_STYLE = dict(max_width=1000, font_size=52, line_height=1.35, pad_x=18, pad_y=10, radius=8)
 
 # auto-clean (seconds); Railway can override via env
 TTL_SECONDS   = int(os.environ.get("TTL_SECONDS", "3600"))    # 1 hour
 CLEAN_INTERVAL = int(os.environ.get("CLEAN_INTERVAL", "600")) # every 10 min
+JOB_EVENTS_INTERVAL = float(os.environ.get("JOB_EVENTS_INTERVAL", "1"))  # /jobs/events refresh, seconds
+# each /jobs/events response holds a server thread, so it ends after this and the browser reconnects
+JOB_EVENTS_MAX_SECONDS = float(os.environ.get("JOB_EVENTS_MAX_SECONDS", "25"))
+
+def _detect_cpus() -> int:
+    """CPUs this process may actually use: affinity mask, capped by a cgroup v2 CPU quota."""
+    n = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            n = min(n, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, n)
+
+CPU_COUNT = _detect_cpus()
+
+# render worker threads per process; FFmpeg does the heavy lifting out-of-process, so threads
+# are enough. The default splits the CPUs across gunicorn's WEB_CONCURRENCY processes.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "0")) or max(1, CPU_COUNT // int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# x264 encoder profiles, picked with ENCODER_PROFILE; ENCODER_PROFILES_FILE (JSON,
+# {"name": {...}}) can add profiles or override fields. threads: a number (0 = x264 decides)
+# or "auto" = detected cores split across the renders currently running.
+ENCODER_PROFILES = {
+    "draft":    {"preset": "ultrafast", "crf": 28, "threads": "auto", "tune": None,   "fps_max": 24},
+    "standard": {"preset": "veryfast",  "crf": 20, "threads": 1,      "tune": None,   "fps_max": 30},
+    "archive":  {"preset": "slow",      "crf": 18, "threads": "auto", "tune": "film", "fps_max": 60},
+    "auto":     {"preset": "veryfast",  "crf": 20, "threads": "auto", "tune": None,   "fps_max": 30},
+}
+if os.environ.get("ENCODER_PROFILES_FILE"):
+    for _name, _fields in json.loads(Path(os.environ["ENCODER_PROFILES_FILE"]).read_text()).items():
+        ENCODER_PROFILES[_name] = {**ENCODER_PROFILES.get(_name, ENCODER_PROFILES["standard"]), **_fields}
+ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "auto")
+if ENCODER_PROFILE not in ENCODER_PROFILES:
+    raise RuntimeError(f"Unknown ENCODER_PROFILE {ENCODER_PROFILE!r}; have {sorted(ENCODER_PROFILES)}")
+
+# ffprobe results kept per file identity (dev, inode, size, mtime)
+PROBE_CACHE_SIZE = int(os.environ.get("PROBE_CACHE_SIZE", "256"))
+
+# render cache: identical (source, caption, design, logo, encoder) requests reuse one output.
+# Outputs are also capped by total size; least-recently-used go first.
+OUTPUTS_MAX_BYTES = int(os.environ.get("OUTPUTS_MAX_BYTES", str(2 << 30)))   # 2 GiB
+OUTPUTS_MIN_FREE_BYTES = int(os.environ.get("OUTPUTS_MIN_FREE_BYTES", str(1 << 30)))   # evict early on a full disk
+OUTPUT_TTL_MAX_FACTOR = int(os.environ.get("OUTPUT_TTL_MAX_FACTOR", "4"))   # downloads stretch TTL up to this
+
+# /download serving: "" sends from this process (sendfile under gunicorn); "x-accel" hands
+# off to nginx via X-Accel-Redirect under SENDFILE_PREFIX; "x-sendfile" to Apache/lighttpd.
+SENDFILE_MODE = os.environ.get("SENDFILE_MODE", "").lower()
+SENDFILE_PREFIX = os.environ.get("SENDFILE_PREFIX", "/protected-outputs")
+if SENDFILE_MODE not in ("", "x-accel", "x-sendfile"):
+    raise RuntimeError(f"Unknown SENDFILE_MODE {SENDFILE_MODE!r}; use x-accel or x-sendfile")
+RENDER_CACHE_VERSION = 3   # bump when layout/compose output changes
+
+# drafts: a quick look at the layout before committing to a full render (see compose_draft)
+DRAFT_WORKERS = int(os.environ.get("DRAFT_WORKERS", "2"))       # own pool, never queued behind renders
+DRAFT_SECONDS = float(os.environ.get("DRAFT_SECONDS", "6"))     # length of a draft clip
+DRAFT_STILL_AT = float(os.environ.get("DRAFT_STILL_AT", "1"))   # seconds in for a draft frame
+DRAFT_SCALE, DRAFT_FPS = 3, 15                                  # clip: 360x640 at 15 fps, x264 ultrafast
+
+# long sources are cut at keyframes and the segments composed in parallel processes
+SEGMENT_MIN_DURATION = float(os.environ.get("SEGMENT_MIN_DURATION", "120"))  # seconds; 0 disables
+SEGMENT_MIN_LENGTH = 20.0   # never cut segments shorter than this (seconds)
+
+# link downloads: pooled connections, parallel HTTP Range chunks when the server allows,
+# resumable .part files, and a size-bounded content-keyed cache of fetched sources
+SOURCE_CACHE_DIR = CACHE_DIR / "sources"
+SOURCE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+SOURCE_CACHE_MAX_BYTES = int(os.environ.get("SOURCE_CACHE_MAX_BYTES", str(2 << 30)))  # 2 GiB
+SOURCE_URL_TTL = int(os.environ.get("SOURCE_URL_TTL", "86400"))  # trust link -> content for a day
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))   # sources prefetched concurrently
+RANGE_PARALLEL = int(os.environ.get("RANGE_PARALLEL", "4"))       # connections per ranged download
+RANGE_CHUNK = 8 << 20
+RANGE_MIN_BYTES = 16 << 20   # below this a single stream is just as fast
+DOWNLOAD_TIMEOUT = 60        # seconds without data before a connection counts as dropped
 
 # -------------------- Flask --------------------
 app = Flask(__name__)
 app.secret_key = "edutap-online-local-only"
+# job, stage-timing and warm-up lines are INFO; without this Python's WARNING default drops them
+app.logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 
 # -------------------- Small helpers --------------------
 def is_url(s: str) -> bool:
     return isinstance(s, str) and s.lower().startswith(("http://", "https://"))
 
-def _stream_to_file(resp: requests.Response, out_path: str, chunk=1<<20):
-    resp.raise_for_status()
-    with open(out_path, "wb") as f:
-        for b in resp.iter_content(chunk_size=chunk):
-            if b:
-                f.write(b)
+@contextmanager
+def stage(timings: dict | None, name: str):
+    """Add the wall time of the `with` body to timings[name] (seconds)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + (time.perf_counter() - t0)
 
 def _gdrive_file_id(url: str):
     m = re.search(r"/file/d/([a-zA-Z0-9_-]+)", url)
@@ -86,38 +193,512 @@ def _resolve_onedrive_download(url: str, session: requests.Session) -> requests.
     r2.raise_for_status()
     return r2
 
-def download_video_to_temp(source: str) -> tuple[str, str]:
-    """
-    Returns (local_path, tmp_dir_to_cleanup_or_empty).
-    If downloaded, tmp_dir is a new temp folder to delete later.
-    """
-    if not is_url(source):
-        return source, ""
-    tmpdir = tempfile.mkdtemp(prefix="viddl_")
-    out_file = os.path.join(tmpdir, "input.mp4")
-    sess = requests.Session(); sess.headers.update({"User-Agent": "Mozilla/5.0"})
-    url = source
-
+def _open_download(url: str) -> requests.Response:
+    """Streaming response for the actual file behind a Drive / OneDrive / direct link."""
     if "drive.google.com" in url:
         fid = _gdrive_file_id(url)
         dl_url = f"https://drive.google.com/uc?export=download&id={fid}" if fid else url
-        r = sess.get(dl_url, stream=True)
+        r = _http.get(dl_url, stream=True, timeout=DOWNLOAD_TIMEOUT)
         if "text/html" in r.headers.get("Content-Type", ""):
             m = re.search(r'confirm=([0-9A-Za-z_]+)', r.text)
             if m and fid:
                 dl_url = f"https://drive.google.com/uc?export=download&confirm={m.group(1)}&id={fid}"
-                r = sess.get(dl_url, stream=True)
-        _stream_to_file(r, out_file)
-        return out_file, tmpdir
+                r = _http.get(dl_url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    elif "1drv.ms" in url or "onedrive.live.com" in url:
+        r = _resolve_onedrive_download(url, _http)
+    else:
+        r = _http.get(url, stream=True, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    r.raise_for_status()
+    return r
+
+# -------------------- Metrics (Prometheus text format) --------------------
+# A small registry exposed on /metrics. Off unless METRICS=1: then every metric_* call
+# returns immediately and /metrics is a 404. Counters and histograms are labelled by
+# keyword arguments; gauges are read at scrape time (see metrics_text). Each process counts
+# in memory and adds what it counted to the totals in the shared store (metrics table)
+# every METRICS_FLUSH_SECONDS and before answering a scrape, so any worker's /metrics
+# reports every process, including ones that have since exited.
+METRICS = os.environ.get("METRICS", "0").lower() in ("1", "true", "yes")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRIC_HELP = {
+    "render_stage_seconds": ("histogram", "Wall time of each render stage"),
+    "http_request_seconds": ("histogram", "Wall time of HTTP requests by endpoint"),
+    "renders_total": ("counter", "Finished render jobs by design and result"),
+    "render_failures_total": ("counter", "Failed render jobs by the stage that failed"),
+    "source_download_bytes_total": ("counter", "Bytes fetched from source links"),
+    "upload_bytes_total": ("counter", "Bytes received as form uploads"),
+    "admission_refusals_total": ("counter", "Requests refused by admission control, by limit"),
+    "child_cpu_seconds_total": ("counter", "CPU time of reaped child processes (ffmpeg, ffprobe)"),
+}
+_metrics_lock = threading.Lock()
+_counters: dict[tuple, float] = {}    # counted since this process's last flush
+_histograms: dict[tuple, list] = {}   # key -> [per-bucket counts..., +Inf count, sum]
+_child_cpu_flushed = [0.0]
+
+def metric_inc(name: str, value: float = 1, **labels):
+    if not METRICS:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def metric_observe(name: str, value: float, **labels):
+    if not METRICS:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(METRIC_BUCKETS) + 2)
+        for i, le in enumerate(METRIC_BUCKETS):
+            if value <= le:
+                h[i] += 1
+                break
+        else:
+            h[-2] += 1
+        h[-1] += value
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
 
-    if "1drv.ms" in url or "onedrive.live.com" in url:
-        r = _resolve_onedrive_download(url, sess)
-        _stream_to_file(r, out_file)
-        return out_file, tmpdir
+def _disk_bytes(paths) -> int:
+    total = 0
+    for p in paths:
+        try:
+            total += p.stat().st_size
+        except FileNotFoundError:
+            pass   # swept between glob and stat
+    return total
+
+def metrics_flush():
+    """Add what this process counted since its last flush to the shared totals."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with _metrics_lock:
+        cpu = usage.ru_utime + usage.ru_stime
+        if cpu > _child_cpu_flushed[0]:
+            key = ("child_cpu_seconds_total", ())
+            _counters[key] = _counters.get(key, 0) + cpu - _child_cpu_flushed[0]
+            _child_cpu_flushed[0] = cpu
+        counters, histograms = dict(_counters), dict(_histograms)
+        _counters.clear()
+        _histograms.clear()
+    rows = [(name, json.dumps(labels), 0, value) for (name, labels), value in counters.items()]
+    rows += [(name, json.dumps(labels), slot, value)
+             for (name, labels), h in histograms.items() for slot, value in enumerate(h) if value]
+    if rows:
+        with _db_tx() as db:
+            db.executemany("INSERT INTO metrics (name, labels, slot, value) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT (name, labels, slot) DO UPDATE SET value = value + excluded.value", rows)
+
+def _metrics_flusher():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            metrics_flush()
+        except sqlite3.Error:
+            app.logger.exception("metrics flush failed")
+
+def metrics_text() -> str:
+    """The shared registry plus scrape-time gauges, in Prometheus exposition format."""
+    metrics_flush()
+    counters, histograms = {}, {}
+    for name, labels, slot, value in _db().execute("SELECT name, labels, slot, value FROM metrics"):
+        if name not in METRIC_HELP:
+            continue   # dropped since it was recorded
+        key = (name, tuple(tuple(pair) for pair in json.loads(labels)))
+        if METRIC_HELP[name][0] == "histogram":
+            histograms.setdefault(key, [0] * (len(METRIC_BUCKETS) + 2))[slot] = value
+        else:
+            counters[key] = value
+    queued = _db().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    gauges = {
+        "render_queue_depth": ("Jobs waiting for a worker", queued),
+        "render_jobs_running": ("Jobs being rendered", running_job_count()),
+        "outputs_disk_bytes": ("Bytes kept in OUTPUTS_DIR", outputs_bytes()),
+        "source_cache_disk_bytes": ("Bytes used by the source cache", _disk_bytes(SOURCE_CACHE_DIR.glob("*.mp4"))),
+    }
+
+    out = []
+    seen = set()
+    def header(name: str):
+        if name not in seen:
+            seen.add(name)
+            kind, text = METRIC_HELP[name]
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name)
+        out.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), h in sorted(histograms.items()):
+        header(name)
+        cumulative = 0
+        for le, n in zip((*METRIC_BUCKETS, "+Inf"), h[:-1]):
+            cumulative += n
+            out.append(f"{name}_bucket{_labels((*labels, ('le', le)))} {cumulative:g}")
+        out.append(f"{name}_sum{_labels(labels)} {h[-1]:.6f}")
+        out.append(f"{name}_count{_labels(labels)} {cumulative:g}")
+    for name, (text, value) in gauges.items():
+        out.append(f"# HELP {name} {text}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {value:g}")
+    return "\n".join(out) + "\n"
+
+# -------------------- Shared store (SQLite) --------------------
+# Everything the processes of a deployment must agree on lives in one SQLite database
+# (JOB_DB) that every server process, and any `python app.py worker`, opens: the job queue
+# (see Render jobs), the link -> source index, output retention, the render cache and its
+# per-key leases, and the metrics totals. Files beside it are written under per-process
+# names and renamed into place, or under a file lock (see file_lock).
+JOB_DB = Path(os.environ.get("JOB_DB", CACHE_DIR / "jobs.sqlite3"))
+JOB_DB_JOURNAL = os.environ.get("JOB_DB_JOURNAL", "wal")   # "delete" when JOB_DB is on a network file system
+_db_local = threading.local()
+
+def _db() -> sqlite3.Connection:
+    # one connection per thread (and per process: never reuse one across fork)
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = sqlite3.connect(JOB_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _db_local.conn, _db_local.pid = conn, os.getpid()
+    return conn
+
+@contextmanager
+def _db_tx():
+    """A write transaction, taking the database lock up front so read-modify-writes can't interleave."""
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _init_db():
+    conn = _db()
+    conn.execute(f"PRAGMA journal_mode={JOB_DB_JOURNAL}")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY, kind TEXT NOT NULL, job_ids TEXT NOT NULL, state TEXT NOT NULL,
+            created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, lease_owner TEXT, lease_until REAL);
+        CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (kind, state, created);
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, task TEXT NOT NULL, status TEXT NOT NULL, finished REAL, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+        CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+        CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, created REAL NOT NULL, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY, sha TEXT NOT NULL, fetched REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS outputs (
+            name TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL,
+            downloads INTEGER NOT NULL DEFAULT 0, expires REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS outputs_expires ON outputs (expires);
+        CREATE TABLE IF NOT EXISTS render_cache (key TEXT PRIMARY KEY, output TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS render_cache_output ON render_cache (output);
+        CREATE TABLE IF NOT EXISTS render_leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS metrics (
+            name TEXT NOT NULL, labels TEXT NOT NULL, slot INTEGER NOT NULL, value REAL NOT NULL,
+            PRIMARY KEY (name, labels, slot));
+    """)
+
+_init_db()
+
+@contextmanager
+def file_lock(path: Path):
+    """An exclusive flock on `path` (created if need be) for the `with` body, across processes and threads."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+# -------------------- Source downloads (pooled, ranged, resumable, cached) --------------------
+# Finished sources live in SOURCE_CACHE_DIR/<sha256>.mp4; the shared store's sources table
+# maps link -> sha. In-progress downloads are SOURCE_CACHE_DIR/partial/<url-hash>.part with
+# a .json sidecar listing finished Range chunks (or, for a single stream, its validator),
+# so an interrupted fetch picks up where it stopped. A .lock beside them makes one process the downloader of a link; any other that
+# wants it waits for that download and then takes it from the cache.
+_http = requests.Session()
+_http.headers.update({"User-Agent": "Mozilla/5.0"})
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+_http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+_source_lock = threading.Lock()
+_source_inflight: dict[str, Future] = {}
+_prepared: OrderedDict[str, tuple[str, dict[str, float]]] = OrderedDict()   # source -> (path, stage seconds), not yet fetched
+_download_pool: ThreadPoolExecutor | None = None
+_download_pool_pid = 0
+_PARTIAL_DIR = SOURCE_CACHE_DIR / "partial"
+
+def _source_path(sha: str) -> Path:
+    return SOURCE_CACHE_DIR / f"{sha}.mp4"
+
+def _cached_source(url: str) -> str | None:
+    """Cached file for `url` if it was fetched within SOURCE_URL_TTL; marks it as used."""
+    row = _db().execute("SELECT sha, fetched FROM sources WHERE url = ?", (url,)).fetchone()
+    if row is None or time.time() - row[1] > SOURCE_URL_TTL:
+        return None
+    p = _source_path(row[0])
+    try:
+        os.utime(p)
+    except FileNotFoundError:
+        return None
+    remember_digest(str(p), row[0])   # named by its sha256: never hashed again
+    return str(p)
+
+def _write_sidecar(path: Path, state: dict):
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+def _ranged_download(url: str, headers: dict, size: int, validator: str, part: Path):
+    """Fetch [0, size) as parallel Range chunks written in place; resumes from the sidecar."""
+    sidecar = part.with_suffix(".json")
+    n_chunks = (size + RANGE_CHUNK - 1) // RANGE_CHUNK
+    state = {"size": size, "validator": validator, "done": []}
+    try:
+        saved = json.loads(sidecar.read_text())
+        if saved.get("size") == size and saved.get("validator") == validator and part.exists():
+            state = saved
+    except (FileNotFoundError, ValueError):
+        pass
+    done = set(state["done"])
+    lock = threading.Lock()
+
+    fd = os.open(part, os.O_RDWR | os.O_CREAT)
+    try:
+        os.ftruncate(fd, size)
+
+        def fetch(i: int):
+            start, end = i * RANGE_CHUNK, min(size, (i + 1) * RANGE_CHUNK) - 1
+            for attempt in range(3):
+                try:
+                    r = _http.get(url, headers={**headers, "Range": f"bytes={start}-{end}"}, stream=True, timeout=DOWNLOAD_TIMEOUT)
+                    if r.status_code != 206:
+                        r.close()
+                        if r.status_code == 429 or r.status_code >= 500:   # transient: try the chunk again
+                            raise requests.HTTPError(f"HTTP {r.status_code} for bytes {start}-{end}", response=r)
+                        if r.status_code == 200:
+                            raise RuntimeError("server ignored Range (HTTP 200)")
+                        raise RuntimeError(f"HTTP {r.status_code} for bytes {start}-{end}")
+                    off = start
+                    for b in r.iter_content(chunk_size=1 << 20):
+                        os.pwrite(fd, b, off)
+                        off += len(b)
+                    if off != end + 1:
+                        raise IOError(f"short read for bytes {start}-{end}")
+                    metric_inc("source_download_bytes_total", off - start)
+                    break
+                except (requests.RequestException, IOError):
+                    if attempt == 2:
+                        raise
+                    time.sleep(0.25 * 2 ** attempt)
+            with lock:
+                done.add(i)
+                _write_sidecar(sidecar, {**state, "done": sorted(done)})
+
+        todo = [i for i in range(n_chunks) if i not in done]
+        with ThreadPoolExecutor(max_workers=RANGE_PARALLEL, thread_name_prefix="range") as ex:
+            list(ex.map(fetch, todo))
+    finally:
+        os.close(fd)
+    sidecar.unlink(missing_ok=True)
 
-    r = sess.get(url, stream=True, allow_redirects=True)
-    _stream_to_file(r, out_file)
-    return out_file, tmpdir
+def _stream_download(resp: requests.Response, url: str, headers: dict, resumable: bool, validator: str,
+                     part: Path):
+    """
+    Single-connection download; if allowed, resumes with Range after a dropped connection,
+    and from a .part an earlier attempt left (in any process) while the validator matches.
+    """
+    sidecar = part.with_suffix(".json")
+    try:
+        saved = json.loads(sidecar.read_text())
+    except (FileNotFoundError, ValueError):
+        saved = {}
+    with open(part, "ab") as f:
+        written = f.seek(0, os.SEEK_END)
+        if not (resumable and validator and saved == {"stream": True, "validator": validator}):
+            f.truncate(0)
+            written = 0
+        if resumable and validator:
+            _write_sidecar(sidecar, {"stream": True, "validator": validator})
+        fetched = 0
+        for attempt in range(4):
+            if attempt or written:
+                resp.close()
+                resp = _http.get(url, headers={**headers, "Range": f"bytes={written}-",
+                                               **({"If-Range": validator} if validator else {})},
+                                 stream=True, timeout=DOWNLOAD_TIMEOUT)
+                m = re.match(r"bytes (\d+)-", resp.headers.get("Content-Range", ""))
+                if resp.status_code != 206 or not m or int(m.group(1)) != written:
+                    resp.close()
+                    raise RuntimeError(f"resuming at byte {written} got HTTP {resp.status_code} "
+                                       f"({resp.headers.get('Content-Range') or 'no Content-Range'})")
+            try:
+                for b in resp.iter_content(chunk_size=1 << 20):
+                    if b:
+                        f.write(b)
+                        written += len(b)
+                        fetched += len(b)
+                        if written > SOURCE_MAX_BYTES:   # no (or a lying) Content-Length
+                            resp.close()
+                            raise ValueError(f"source is larger than {SOURCE_MAX_BYTES >> 20} MiB")
+                break
+            except (requests.RequestException, IOError):
+                f.flush()
+                if not resumable or attempt == 3:
+                    raise
+    metric_inc("source_download_bytes_total", fetched)
+    sidecar.unlink(missing_ok=True)
+
+def _download_source(url: str) -> str:
+    cached = _cached_source(url)
+    if cached:
+        return cached
+    _PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+    part = _PARTIAL_DIR / (hashlib.sha1(url.encode()).hexdigest() + ".part")
+    with file_lock(part.with_suffix(".lock")):   # one writer per .part, in any process
+        dest = _cached_source(url)   # fetched while we waited for the lock
+        if dest is None:
+            dest = _fetch_into_cache(url, part)
+    sweep_sources()
+    return dest
+
+def _fetch_into_cache(url: str, part: Path) -> str:
+    resp = _open_download(url)
+    final_url = resp.url
+    headers = {k: v for k, v in resp.request.headers.items() if k == "Referer"}
+    resumable = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+    size = int(resp.headers.get("Content-Length") or 0) if "Content-Encoding" not in resp.headers else 0
+    validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified") or ""
+    if size > SOURCE_MAX_BYTES:   # refused before a byte of the body is read
+        resp.close()
+        raise ValueError(f"source is {size >> 20} MiB; the limit is {SOURCE_MAX_BYTES >> 20} MiB")
+
+    try:
+        if resumable and size >= RANGE_MIN_BYTES:
+            resp.close()
+            _ranged_download(final_url, headers, size, validator, part)
+        else:
+            _stream_download(resp, final_url, headers, resumable, validator, part)
+    except ValueError:
+        part.unlink(missing_ok=True)   # over budget: nothing worth resuming
+        part.with_suffix(".json").unlink(missing_ok=True)
+        raise
+
+    sha = file_digest(str(part))
+    dest = _source_path(sha)
+    if dest.exists():
+        part.unlink(missing_ok=True)   # same content already cached under another link
+        os.utime(dest)
+    else:
+        os.replace(part, dest)
+    with _db_tx() as db:
+        db.execute("INSERT OR REPLACE INTO sources (url, sha, fetched) VALUES (?, ?, ?)", (url, sha, time.time()))
+    return str(dest)
+
+def _source_downloads() -> ThreadPoolExecutor:
+    global _download_pool, _download_pool_pid
+    with _source_lock:
+        if _download_pool is None or _download_pool_pid != os.getpid():
+            _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download")
+            _download_pool_pid = os.getpid()
+        return _download_pool
+
+def _prepare_source(source: str) -> str:
+    # download (links), then probe and hash once, so every job on this source hits the caches;
+    # the time each took is kept for the job that fetches it (see fetch_source)
+    timings: dict[str, float] = {}
+    path = source
+    if is_url(source):
+        with stage(timings, "download"):
+            path = _download_source(source)
+    with stage(timings, "probe"):
+        check_source(path)   # before any job spends an ffmpeg run on it
+    with stage(timings, "hash"):
+        file_digest(path)
+    with _source_lock:
+        _prepared[source] = (path, timings)
+        _prepared.move_to_end(source)
+        while len(_prepared) > 256:
+            _prepared.popitem(last=False)
+    return path
+
+def prefetch_source(source: str) -> Future:
+    """
+    Start fetching, probing and hashing a source in the background (deduplicated per
+    source), so the download of one item overlaps with encoding of another. Jobs only do
+    this for links; batches also warm up local paths shared by several items.
+    """
+    pool = _source_downloads()
+    with _source_lock:
+        fut = _source_inflight.get(source)
+        if fut is not None:
+            return fut
+        fut = _source_inflight[source] = pool.submit(_prepare_source, source)
+    # outside the lock: a future that already failed runs the callback right here
+    fut.add_done_callback(lambda _f: _forget_inflight(source, _f))
+    return fut
+
+def _forget_inflight(source: str, fut: Future):
+    with _source_lock:
+        if _source_inflight.get(source) is fut:
+            del _source_inflight[source]
+
+def fetch_source(source: str, timings: dict | None = None) -> str:
+    """
+    Local path for an upload path or a link (waiting on / starting its download). The
+    download, probe and hash stages it took, in a prefetch too, are added to `timings`.
+    """
+    with _source_lock:
+        fut = _source_inflight.get(source)   # for a local path: a batch may be warming it up
+        ready = _prepared.pop(source, None) if fut is None else None
+    try:
+        if ready is None and (fut is not None or is_url(source)):
+            path = (fut or prefetch_source(source)).result()
+            with _source_lock:
+                ready = _prepared.pop(source, (path, {}))   # {}: another job already reported it
+    except Exception:
+        if timings is not None:
+            timings.setdefault("download", 0.0)   # so a failure is put down to fetching
+        raise
+    path, spent = ready or (source, {})
+    if timings is not None:
+        for name, seconds in spent.items():
+            timings[name] = timings.get(name, 0.0) + seconds
+    return path
+
+def sweep_sources():
+    """
+    Evict least-recently-used cached sources above SOURCE_CACHE_MAX_BYTES. The sources of
+    queued and running jobs (in any process) stay.
+    """
+    pinned = {sha for (sha,) in _db().execute(
+        "SELECT sources.sha FROM jobs JOIN sources ON sources.url = json_extract(jobs.data, '$.source') "
+        "WHERE jobs.status IN ('queued', 'running')")}
+    files = []
+    for p in SOURCE_CACHE_DIR.glob("*.mp4"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files, key=lambda f: f[0]):
+        if total <= SOURCE_CACHE_MAX_BYTES:
+            break
+        if p.stem in pinned:
+            continue
+        p.unlink(missing_ok=True)
+        total -= size
+    stale = [(url,) for url, sha in _db().execute("SELECT url, sha FROM sources") if not _source_path(sha).exists()]
+    if stale:
+        with _db_tx() as db:
+            db.executemany("DELETE FROM sources WHERE url = ?", stale)
 
 def ffprobe_json(path: str):
     out = subprocess.check_output(
@@ -126,8 +707,27 @@ def ffprobe_json(path: str):
     )
     return json.loads(out)
 
+_probe_cache: OrderedDict[tuple, dict] = OrderedDict()
+_probe_lock = threading.Lock()
+
+def probe_video(path: str) -> dict:
+    """ffprobe_json, memoised by file identity so a re-used source is probed only once."""
+    st = os.stat(path)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _probe_lock:
+        meta = _probe_cache.get(key)
+        if meta is not None:
+            _probe_cache.move_to_end(key)
+            return meta
+    meta = ffprobe_json(path)
+    with _probe_lock:
+        _probe_cache[key] = meta
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return meta
+
 def derive_fps(meta) -> int:
-    """Clamp to a CPU-friendly FPS (24–30)."""
+    """Clamp to a CPU-friendly FPS (24 up to the encoder profile's fps_max)."""
     try:
         vstream = next(s for s in meta["streams"] if s.get("codec_type")=="video")
         rfr = vstream.get("r_frame_rate") or "25/1"
@@ -135,97 +735,571 @@ def derive_fps(meta) -> int:
         fps = max(1, int(round(float(num)/float(den)))) if float(den)!=0 else 25
     except Exception:
         fps = 25
-    # Clamp for CPU on Hobby plan
-    fps = max(24, min(fps, 30))
+    # Clamp for CPU (standard profile: 24–30, as on the Hobby plan)
+    cap = int(ENCODER_PROFILES[ENCODER_PROFILE]["fps_max"])
+    fps = max(min(24, cap), min(fps, cap))
     return fps
 
+# -------- source budget: what a single item may ask of ffmpeg --------
+SOURCE_MAX_BYTES = int(os.environ.get("SOURCE_MAX_BYTES", str(2 << 30)))          # 2 GiB per upload / link
+SOURCE_MAX_SECONDS = float(os.environ.get("SOURCE_MAX_SECONDS", "900"))           # 15 minutes
+SOURCE_MAX_PIXELS = int(os.environ.get("SOURCE_MAX_PIXELS", str(4096 * 2304)))    # a little over 4K UHD
+
+def media_duration(meta: dict) -> float:
+    try:
+        return float(meta["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+def check_source(path: str) -> dict:
+    """Probe a fetched source and hold it to the SOURCE_MAX_* budget; raises ValueError, else returns the probe."""
+    size = os.path.getsize(path)
+    if size > SOURCE_MAX_BYTES:
+        raise ValueError(f"source is {size >> 20} MiB; the limit is {SOURCE_MAX_BYTES >> 20} MiB")
+    try:
+        meta = probe_video(path)
+    except subprocess.CalledProcessError:
+        raise ValueError("source is not a readable video") from None
+    vstream = next((s for s in meta.get("streams", []) if s.get("codec_type") == "video"), None)
+    if vstream is None:
+        raise ValueError("source has no video stream")
+    w, h = int(vstream.get("width") or 0), int(vstream.get("height") or 0)
+    if w * h > SOURCE_MAX_PIXELS:
+        raise ValueError(f"source is {w}x{h}; the limit is {SOURCE_MAX_PIXELS / 1e6:.1f} megapixels")
+    duration = media_duration(meta)
+    if duration > SOURCE_MAX_SECONDS:
+        raise ValueError(f"source is {duration:.0f}s long; the limit is {SOURCE_MAX_SECONDS:.0f}s")
+    return meta
+
 # -------------------- Caption rendering (Pillow) --------------------
-def _load_font(size: int) -> ImageFont.FreeTypeFont|ImageFont.ImageFont:
-    # Try bundled Poppins SemiBold first; fallback to default PIL font
-    candidates = [
-        FONTS_DIR / "Poppins-SemiBold.ttf",
-        FONTS_DIR / "Poppins-SemiBold.otf",
-    ]
-    for p in candidates:
-        if p.exists():
-            try:
-                return ImageFont.truetype(str(p), size=size)
-            except Exception:
-                pass
-    return ImageFont.load_default()
+# Font fallback chain: each codepoint is drawn with the first bundled font that covers it
+# (Poppins for Latin/Devanagari, then Noto for everything else). Coverage comes from the
+# fonts' cmaps, indexed once and persisted to CACHE_DIR/font_coverage.json.
+FONT_CHAIN = (
+    "Poppins-SemiBold.ttf",
+    "NotoSans-Regular.ttf",
+    "NotoSansDevanagari-Regular.ttf",
+    "NotoSansArabic-Regular.ttf",
+    "NotoSansSymbols2-Regular.ttf",
+)
+FONT_COVERAGE_PATH = CACHE_DIR / "font_coverage.json"
+
+# Complex scripts (Arabic joining, Devanagari conjuncts) need libraqm for shaping; Pillow
+# wheels use it when libfribidi is installed (see Dockerfile). Without it, Arabic falls
+# back to arabic_reshaper + python-bidi (requirements.txt); Devanagari has no fallback, so
+# warm_up warns when raqm is missing.
+HAS_RAQM = features.check_feature("raqm")
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+
+_ARABIC_RANGES = ((0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF))
+
+@lru_cache(maxsize=32)
+def _truetype(path: str, size: int) -> ImageFont.FreeTypeFont:
+    # process-wide: each (font file, size) is parsed from disk once
+    return ImageFont.truetype(path, size=size)
+
+def _chain_paths() -> list[Path]:
+    return [FONTS_DIR / name for name in FONT_CHAIN if (FONTS_DIR / name).exists()]
+
+_coverage_lock = threading.Lock()
+_coverage: list[frozenset[int]] | None = None     # per chain font: codepoints it has glyphs for
+_cp_font: dict[int, int] = {}                     # codepoint -> first chain font covering it
+
+def _build_coverage(paths: list[Path]) -> dict[str, list[list[int]]]:
+    from fontTools.ttLib import TTFont
+    out = {}
+    for p in paths:
+        cps = sorted(TTFont(str(p), lazy=True).getBestCmap())
+        ranges: list[list[int]] = []
+        for cp in cps:
+            if ranges and ranges[-1][1] == cp - 1:
+                ranges[-1][1] = cp
+            else:
+                ranges.append([cp, cp])
+        out[p.name] = ranges
+    return out
+
+def font_coverage() -> tuple[list[frozenset[int]], dict[int, int]]:
+    """(per-font coverage sets, codepoint -> chain index); loaded from disk or built once."""
+    global _coverage
+    with _coverage_lock:
+        if _coverage is not None:
+            return _coverage, _cp_font
+        paths = _chain_paths()
+        sig = [[p.name, p.stat().st_size, p.stat().st_mtime_ns] for p in paths]
+        try:
+            saved = json.loads(FONT_COVERAGE_PATH.read_text())
+            if saved["fonts"] != sig:
+                raise ValueError("font set changed")
+            ranges = saved["ranges"]
+        except (FileNotFoundError, ValueError, KeyError):
+            ranges = _build_coverage(paths)
+            tmp = FONT_COVERAGE_PATH.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"fonts": sig, "ranges": ranges}))
+            os.replace(tmp, FONT_COVERAGE_PATH)
+        cover = []
+        for i, p in enumerate(paths):
+            cps = frozenset(cp for lo, hi in ranges[p.name] for cp in range(lo, hi + 1))
+            cover.append(cps)
+            for cp in cps:
+                _cp_font.setdefault(cp, i)
+        _coverage = cover
+        return _coverage, _cp_font
+
+def _font_chain(size: int) -> list[ImageFont.FreeTypeFont|ImageFont.ImageFont]:
+    fonts = []
+    for p in _chain_paths():
+        try:
+            fonts.append(_truetype(str(p), size))
+        except Exception:
+            fonts.append(None)
+    primary = next((f for f in fonts if f is not None), None) or ImageFont.load_default()
+    return [f or primary for f in fonts] or [primary]
 
-def _wrap_text(text: str, font: ImageFont.ImageFont, max_w: int, draw: ImageDraw.ImageDraw):
-    # simple word-wrap using textlength if available
+@lru_cache(maxsize=1 << 14)
+def _split_runs(text: str) -> tuple[tuple[int, str], ...]:
+    """
+    Split text into (chain font index, substring) runs. Letters go to the first font that
+    covers them; spaces, digits, punctuation and combining marks stay in the current run
+    when its font has them, so words aren't fragmented.
+    """
+    cover, cp_font = font_coverage()
+    if not cover:
+        return ((0, text),) if text else ()
+    runs: list[list] = []
+    for ch in text:
+        cp = ord(ch)
+        cur = runs[-1][0] if runs else None
+        if cur is not None and (cp in cover[cur] and unicodedata.category(ch)[0] != "L"
+                                or cp not in cp_font):
+            idx = cur
+        else:
+            idx = cp_font.get(cp, 0)
+        if runs and runs[-1][0] == idx:
+            runs[-1][1] += ch
+        else:
+            runs.append([idx, ch])
+    return tuple((idx, run) for idx, run in runs)
+
+def _is_arabic(text: str) -> bool:
+    return any(lo <= ord(ch) <= hi for ch in text for lo, hi in _ARABIC_RANGES)
+
+def _first_strong_rtl(text: str) -> bool:
+    for ch in text:
+        d = unicodedata.bidirectional(ch)
+        if d in ("R", "AL"):
+            return True
+        if d == "L":
+            return False
+    return False
+
+@lru_cache(maxsize=1 << 14)
+def _shape(run: str) -> str:
+    # raqm shapes and orders inside Pillow; otherwise pre-shape Arabic into presentation forms
+    if HAS_RAQM or arabic_reshaper is None or not _is_arabic(run):
+        return run
+    return get_display(arabic_reshaper.reshape(run))
+
+@lru_cache(maxsize=1 << 16)
+def _text_width(font: ImageFont.ImageFont, s: str) -> float:
+    # memoised per (font, run); fonts come from the cache above, so identity is stable
+    return font.getlength(s) if hasattr(font, "getlength") else font.getsize(s)[0]
+
+def _measure(text: str, fonts: tuple) -> float:
+    return sum(_text_width(fonts[min(idx, len(fonts)-1)], _shape(run)) for idx, run in _split_runs(text))
+
+def _wrap_text(text: str, fonts: tuple, max_w: int) -> list[tuple[str, float]]:
+    """
+    Greedy word-wrap in one pass. Each word is measured once (memoised) and line widths
+    are summed from word + space widths, so wrapping is linear in the number of words.
+    Returns [(line, width)].
+    """
     words = (text or "").replace("\r","").split()
-    lines, curr = [], ""
+    space_w = _text_width(fonts[0], " ")
+    lines, curr, curr_w = [], [], 0.0
     for w in words:
-        test = (curr + " " + w).strip()
-        width = draw.textlength(test, font=font) if hasattr(draw, "textlength") else font.getsize(test)[0]
-        if width <= max_w or not curr:
-            curr = test
+        ww = _measure(w, fonts)
+        test_w = curr_w + space_w + ww if curr else ww
+        if test_w <= max_w or not curr:
+            curr.append(w); curr_w = test_w
         else:
-            lines.append(curr)
-            curr = w
+            lines.append((" ".join(curr), curr_w))
+            curr, curr_w = [w], ww
     if curr:
-        lines.append(curr)
+        lines.append((" ".join(curr), curr_w))
     if not lines:
-        lines = [""]
+        lines = [("", 0.0)]
     return lines
 
-def render_caption_png_pillow(text: str, out_path: Path, *,
-                              max_width: int = 1000,
-                              font_size: int = 52,
-                              line_height: float = 1.35,
-                              pad_x: int = 18,
-                              pad_y: int = 10,
-                              radius: int = 8):
-    """Render text as a white rounded box with black text onto a transparent PNG."""
-    font = _load_font(font_size)
-    dummy = Image.new("RGBA", (10,10), (0,0,0,0))
-    dr = ImageDraw.Draw(dummy)
-    lines = _wrap_text(text, font, max_width, dr)
-
-    # measure
-    ascent, descent = font.getmetrics() if hasattr(font, "getmetrics") else (font.size, 0)
-    line_px = int((ascent+descent) * line_height) if ascent else int(font.size*line_height)
-    text_w = 0
-    for ln in lines:
-        w = dr.textlength(ln, font=font) if hasattr(dr,"textlength") else font.getsize(ln)[0]
-        text_w = max(text_w, int(w))
+def _metrics(font) -> tuple[int, int]:
+    return font.getmetrics() if hasattr(font, "getmetrics") else (font.size, 0)
+
+def render_caption_image(text: str, *,
+                         max_width: int = 1000,
+                         font_size: int = 52,
+                         line_height: float = 1.35,
+                         pad_x: int = 18,
+                         pad_y: int = 10,
+                         radius: int = 8) -> Image.Image:
+    """Render text as a white rounded box with black text on a transparent RGBA image."""
+    fonts = tuple(_font_chain(font_size))
+    lines = _wrap_text(text, fonts, max_width)   # single layout pass: sizing and drawing share it
+
+    # measure: line pitch follows the primary font; fallback runs share its baseline
+    ascent, descent = _metrics(fonts[0])
+    line_px = int((ascent+descent) * line_height) if ascent else int(fonts[0].size*line_height)
+    text_w = max(int(w) for _, w in lines)
     text_h = line_px * len(lines)
 
     box_w = text_w + pad_x*2
     box_h = text_h + pad_y*2
 
     img = Image.new("RGBA", (box_w, box_h), (0,0,0,0))
-    dr2 = ImageDraw.Draw(img)
-    dr2.rounded_rectangle((0,0,box_w,box_h), radius, fill=(255,255,255,255))
+    dr = ImageDraw.Draw(img)
+    dr.rounded_rectangle((0,0,box_w,box_h), radius, fill=(255,255,255,255))
 
-    # draw lines centered horizontally
+    # draw lines centered horizontally; right-to-left lines lay their runs out in reverse,
+    # with each run's trailing space on its left
     y = pad_y
-    for ln in lines:
-        w = dr2.textlength(ln, font=font) if hasattr(dr2, "textlength") else font.getsize(ln)[0]
+    for ln, w in lines:
         x = (box_w - int(w))//2
-        dr2.text((x,y), ln, font=font, fill=(0,0,0,255))
+        runs = _split_runs(ln)
+        rtl = _first_strong_rtl(ln)
+        if rtl:
+            runs = runs[::-1]
+        for idx, run in runs:
+            font = fonts[min(idx, len(fonts)-1)]
+            core = run.rstrip()
+            shaped = _shape(core)
+            gap = _text_width(font, run[len(core):])
+            if rtl:
+                x += gap
+            dr.text((x, y + ascent - _metrics(font)[0]), shaped, font=font, fill=(0,0,0,255))
+            x += _text_width(font, shaped) + (0 if rtl else gap)
         y += line_px
 
-    img.save(out_path, "PNG")
+    return img
 
 # -------------------- Compose (FFmpeg, CPU-only) --------------------
-def _cpu_vcodec_args():
-    # Conservative settings for small CPU/RAM (Railway Hobby)
-    return ["-c:v","libx264","-preset","veryfast","-crf","20","-pix_fmt","yuv420p","-threads","1"]
+def encoder_threads(profile: dict) -> int:
+    """x264 threads for one render: fixed by the profile, or for "auto" the cores divided
+    among the renders running right now (a lone render gets the whole machine)."""
+    if profile["threads"] != "auto":
+        return int(profile["threads"])
+    return max(1, CPU_COUNT // max(1, running_task_count()))
+
+def _cpu_vcodec_args(threads: int | None = None):
+    profile = ENCODER_PROFILES[ENCODER_PROFILE]
+    args = ["-c:v","libx264","-preset",profile["preset"],"-crf",str(profile["crf"])]
+    if profile.get("tune"):
+        args += ["-tune", profile["tune"]]
+    return args + ["-pix_fmt","yuv420p","-threads",str(threads or encoder_threads(profile))]
+
+def encoder_cache_key() -> dict:
+    # everything that changes the encoded picture; the thread count doesn't
+    return {k: v for k, v in ENCODER_PROFILES[ENCODER_PROFILE].items() if k != "threads"}
+
+_logo_sizes: dict[tuple, tuple[int, int]] = {}
+
+def logo_size(logo_path: str) -> tuple[int, int]:
+    """(w, h) of the logo file, read once per file version."""
+    key = (logo_path, os.stat(logo_path).st_mtime_ns)
+    if key not in _logo_sizes:
+        with Image.open(logo_path) as lg:
+            _logo_sizes[key] = lg.size
+    return _logo_sizes[key]
+
+@lru_cache(maxsize=4)
+def _scaled_logo(logo_path: str, mtime_ns: int, width: int = 120) -> Image.Image:
+    with Image.open(logo_path) as lg:
+        lg = lg.convert("RGBA")
+        return lg.resize((width, max(1, round(width * lg.height / lg.width))), Image.LANCZOS)
 
-def compose_full(local_video_path: str, caption_png: Path, output_path: Path, logo_path: str):
-    meta = ffprobe_json(local_video_path)
-    fps = derive_fps(meta)
+def scaled_logo(logo_path: str) -> Image.Image:
+    """The logo at its on-canvas width (120 px), as RGBA."""
+    return _scaled_logo(logo_path, os.stat(logo_path).st_mtime_ns)
 
-    # measure caption & logo
-    with Image.open(caption_png) as im: cap_w, cap_h = im.size
-    with Image.open(logo_path) as lg:
-        lw, lh = lg.size
-        logo_target = 120
-        logo_h = int(round(logo_target * (lh / lw))) if lw else 0
+def _rgba_inputs(images: list[Image.Image], fps: int) -> tuple[list[str], list[tuple[int, int, bytes]]]:
+    """
+    FFmpeg input args that read each image as a single raw RGBA frame from its own pipe.
+    Returns (args, feeds); pass feeds to _run_ffmpeg. A one-frame overlay input is held
+    on its last frame by `overlay`, so no -loop / PNG round-trip is needed.
+    """
+    args, feeds = [], []
+    for img in images:
+        img = img.convert("RGBA")
+        r, w = os.pipe()
+        args += ["-f","rawvideo","-pix_fmt","rgba","-video_size",f"{img.width}x{img.height}",
+                 "-framerate",str(fps),"-i",f"pipe:{r}"]
+        feeds.append((r, w, img.tobytes()))
+    return args, feeds
+
+def _write_feed(fd: int, data: bytes):
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its return code tells the story
+
+def _run_ffmpeg(cmd: list[str], feeds: list[tuple[int, int, bytes]] = (), on_progress=None):
+    """
+    Run ffmpeg, streaming each in-memory feed into its pipe; raises CalledProcessError on failure.
+    With on_progress, ffmpeg reports through -progress on stdout and each update is passed on
+    as on_progress(out_time_seconds, fps, speed_multiplier).
+    """
+    if on_progress is not None:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    try:
+        proc = subprocess.Popen(cmd, pass_fds=[r for r, _, _ in feeds],
+                                stdout=subprocess.PIPE if on_progress else None, text=True)
+    except Exception:
+        for r, w, _ in feeds:
+            os.close(r); os.close(w)
+        raise
+    writers = []
+    for r, w, data in feeds:
+        os.close(r)
+        t = threading.Thread(target=_write_feed, args=(w, data), daemon=True)
+        t.start()
+        writers.append(t)
+    if on_progress is not None:
+        _read_progress(proc.stdout, on_progress)
+    rc = proc.wait()
+    for t in writers:
+        t.join()
+    if rc:
+        raise subprocess.CalledProcessError(rc, cmd)
+
+def _progress_number(value: str | None) -> float:
+    try:
+        return float((value or "").rstrip("x"))
+    except ValueError:
+        return 0.0   # "N/A" until ffmpeg has a value
+
+def _read_progress(stream, on_progress):
+    # -progress emits key=value lines in blocks, each closed by progress=continue|end
+    block = {}
+    for line in stream:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        if key == "progress":
+            out_us = _progress_number(block.get("out_time_us") or block.get("out_time_ms"))
+            on_progress(max(0.0, out_us / 1e6), _progress_number(block.get("fps")),
+                        _progress_number(block.get("speed")))
+            block = {}
+
+def _compose_cmd(local_video_path: str, still_args: list[str], filter_graph: str,
+                 fps: int, output_path: Path, *, start: float | None = None, duration: float | None = None,
+                 threads: int | None = None, audio: bool = True, decode: list[str] = ()) -> list[str]:
+    # inputs: 0 = source (optionally a [start, start+duration) window, decoder options from
+    # decode_args), 1.. = still layers from _rgba_inputs; every compose graph is written
+    # against these indices
+    window = []
+    if start is not None:
+        window += ["-ss", f"{start:.3f}"]
+    if duration is not None:
+        window += ["-t", f"{duration:.3f}"]
+    return [
+        "ffmpeg","-y","-nostdin",
+        *window, *decode, "-i", local_video_path,
+        *still_args,
+        "-filter_complex", filter_graph,
+        "-shortest",
+        *_cpu_vcodec_args(threads),
+        *(["-c:a","aac","-b:a","128k"] if audio else ["-an"]),
+        "-movflags","+faststart",
+        str(output_path)
+    ]
+
+def _keyframe_times(path: str) -> list[float]:
+    """Presentation times of the video keyframes (packet flags only, nothing is decoded)."""
+    out = subprocess.check_output(
+        ["ffprobe","-v","error","-select_streams","v:0","-show_entries","packet=pts_time,flags",
+         "-of","csv=p=0",path],
+        text=True
+    )
+    times = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            times.append(float(pts))
+    return sorted(times)
+
+def _segment_plan(path: str, duration: float, n: int) -> list[tuple[float, float | None]]:
+    """Split [0, duration) into up to n (start, length) windows that begin on keyframes."""
+    keyframes = _keyframe_times(path)
+    cuts = [0.0]
+    for i in range(1, n):
+        target = duration * i / n
+        k = min(keyframes, key=lambda t: abs(t - target), default=None)
+        if k is not None and k - cuts[-1] >= SEGMENT_MIN_LENGTH and duration - k >= SEGMENT_MIN_LENGTH:
+            cuts.append(k)
+    return [(a, b - a) for a, b in zip(cuts, cuts[1:])] + [(cuts[-1], None)]
+
+def _segment_count(duration: float) -> int:
+    if not SEGMENT_MIN_DURATION or duration < SEGMENT_MIN_DURATION:
+        return 1
+    # the cores this render may use right now, one x264 process per segment
+    free = max(1, CPU_COUNT // max(1, running_task_count()))
+    return max(1, min(free, int(duration // SEGMENT_MIN_LENGTH)))
+
+def _progress_reporter(on_progress, duration: float):
+    """ffmpeg's (out_time, fps, speed) -> on_progress(done, total, fps, speed), done capped at the duration."""
+    if on_progress is None:
+        return None
+    return lambda t, f, x: on_progress(min(t, duration or t), duration, f, x)
+
+def _encode(local_video_path: str, meta: dict, fps: int, still: Image.Image,
+            filter_graph: str, output_path: Path, timings: dict | None, on_progress=None,
+            decode: list[str] = ()):
+    """
+    Run a compose graph: one ffmpeg process, or keyframe-aligned segments in parallel for long
+    sources. on_progress(done_seconds, total_seconds, fps, speed) follows the whole encode.
+    """
+    duration = media_duration(meta)
+    report = _progress_reporter(on_progress, duration)
+    n = _segment_count(duration)
+    if n > 1:
+        with stage(timings, "segment_plan"):
+            plan = _segment_plan(local_video_path, duration, n)
+        if len(plan) > 1:
+            _encode_segments(local_video_path, plan, fps, still, filter_graph, output_path, timings, report,
+                             decode)
+            return
+    still_args, feeds = _rgba_inputs([still], fps)
+    cmd = _compose_cmd(local_video_path, still_args, filter_graph, fps, output_path, decode=decode)
+    with stage(timings, "encode"):
+        _run_ffmpeg(cmd, feeds, report)
+
+def _encode_segments(local_video_path: str, plan: list[tuple[float, float | None]], fps: int,
+                     still: Image.Image, filter_graph: str, output_path: Path,
+                     timings: dict | None, report=None, decode: list[str] = ()):
+    """
+    Compose each window video-only in its own process, then join them with the concat
+    demuxer (stream copy) and encode the source's audio once over the whole length, so the
+    soundtrack has no seams at the cuts.
+    """
+    seg_dir = Path(tempfile.mkdtemp(prefix="segments_"))
+    threads = max(1, CPU_COUNT // len(plan))
+    latest = [(0.0, 0.0, 0.0)] * len(plan)   # per segment: (out_time, fps, speed)
+    lock = threading.Lock()
+    try:
+        def run(i: int):
+            start, length = plan[i]
+
+            def seg_progress(t: float, f: float, x: float):
+                # overall progress = media done across segments; rates add up
+                with lock:
+                    latest[i] = (t, f, x)
+                    report(*(sum(v) for v in zip(*latest)))
+
+            still_args, feeds = _rgba_inputs([still], fps)
+            cmd = _compose_cmd(local_video_path, still_args, filter_graph, fps,
+                               seg_dir / f"seg{i:03d}.mp4", start=start, duration=length,
+                               threads=threads, audio=False, decode=decode)
+            _run_ffmpeg(cmd, feeds, seg_progress if report else None)
+
+        with stage(timings, "encode"):
+            with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix="segment") as ex:
+                list(ex.map(run, range(len(plan))))
+
+        listing = seg_dir / "segments.txt"
+        listing.write_text("".join(f"file '{seg_dir / f'seg{i:03d}.mp4'}'\n" for i in range(len(plan))))
+        with stage(timings, "concat"):
+            _run_ffmpeg([
+                "ffmpeg","-y","-nostdin",
+                "-f","concat","-safe","0","-i", str(listing),
+                "-i", local_video_path,
+                "-map","0:v","-map","1:a?",
+                "-c:v","copy",
+                "-c:a","aac","-b:a","128k",
+                "-shortest",
+                "-movflags","+faststart",
+                str(output_path)
+            ])
+    finally:
+        shutil.rmtree(seg_dir, ignore_errors=True)
+
+# -------- source geometry --------
+# ffmpeg autorotates by the display matrix, so a phone clip stored 1920x1080 with a 90°
+# rotation reaches the filter graph as 1080x1920. Layouts work on that display size (with
+# non-square pixels made square), fit oversized sources into the canvas, and keep every
+# size and offset even so yuv420p chroma lines up with what the still layers assume.
+LOWRES_CODECS = {"mjpeg", "mpeg1video", "mpeg2video", "mpeg4", "h263", "jpeg2000"}   # honour -lowres
+
+def _rotation(vstream: dict) -> int:
+    for side in vstream.get("side_data_list") or []:
+        if "rotation" in side:
+            return int(round(float(side["rotation"])))
+    try:
+        return int(float((vstream.get("tags") or {}).get("rotate", 0)))
+    except ValueError:
+        return 0
+
+def source_geometry(meta: dict) -> dict:
+    """
+    w/h: display size of the first video stream after autorotation and square pixels;
+    frame_w/frame_h: the size decoded frames actually have when they reach the graph.
+    """
+    vstream = next(s for s in meta["streams"] if s.get("codec_type") == "video")
+    frame_w, frame_h = int(vstream["width"]), int(vstream["height"])
+    w = frame_w
+    try:
+        num, den = (int(x) for x in (vstream.get("sample_aspect_ratio") or "1:1").split(":"))
+    except ValueError:
+        num = den = 1
+    if num > 0 and den > 0 and num != den:
+        w = max(2, round(frame_w * num / den))
+    h = frame_h
+    if _rotation(vstream) % 180 == 90:
+        w, h, frame_w, frame_h = h, w, frame_h, frame_w
+    return {"w": w, "h": h, "frame_w": frame_w, "frame_h": frame_h, "codec": vstream.get("codec_name", "")}
+
+def fit_size(w: int, h: int, max_w: int, max_h: int, upscale: bool = False) -> tuple[int, int]:
+    """(w, h) scaled to fit max_w x max_h keeping the aspect, rounded down to even numbers."""
+    f = min(max_w / w, max_h / h)
+    if not upscale:
+        f = min(f, 1.0)
+    return max(2, min(max_w, round(w * f)) // 2 * 2), max(2, min(max_h, round(h * f)) // 2 * 2)
+
+def decode_args(geo: dict, out_w: int, out_h: int) -> list[str]:
+    """
+    Input options for a source at least twice the size it's shown at: codecs that support it
+    decode straight to 1/2, 1/4 or 1/8 size (-lowres). h264/hevc have no such mode; for them
+    the graph's first scale does the work.
+    """
+    ratio = min(geo["w"] / out_w, geo["h"] / out_h)
+    if ratio < 2 or geo["codec"] not in LOWRES_CODECS:
+        return []
+    return ["-lowres", str(min(3, int(math.log2(ratio))))]
+
+def _fit_filters(geo: dict, w: int, h: int) -> list[str]:
+    """
+    Decoded frames -> w x h: nothing, a crop of an odd last row/column, or one scale. Bilinear
+    for 2x and more down (swscale widens the filter to the ratio, so it still averages every
+    source pixel), at about half the cost of the default bicubic on a 4K source.
+    """
+    fw, fh = geo["frame_w"], geo["frame_h"]
+    if (fw, fh) == (w, h):
+        return []
+    if (fw, fh) == (geo["w"], geo["h"]) and 0 <= fw - w <= 1 and 0 <= fh - h <= 1:
+        return [f"crop={w}:{h}:0:0"]
+    flags = ":flags=bilinear" if min(geo["w"] / w, geo["h"] / h) >= 2 else ""
+    return [f"scale={w}:{h}{flags}", "setsar=1"]
+
+def _even_offset(space: int) -> int:
+    return max(0, space) // 4 * 2
+
+def layout_full(caption_size: tuple[int, int], logo_path: str) -> dict:
+    """FULL: caption under the logo, video scaled into the space below, on the accent canvas."""
+    cap_w, cap_h = caption_size
+    lw, lh = logo_size(logo_path)
+    logo_target = 120
+    logo_h = int(round(logo_target * (lh / lw))) if lw else 0
 
     caption_top_min = 80
     caption_clearance = 20
@@ -234,75 +1308,342 @@ def compose_full(local_video_path: str, caption_png: Path, output_path: Path, lo
     logo_margin_y = 40
 
     caption_y = max(caption_top_min, logo_margin_y + logo_h + caption_clearance)
-    video_top = caption_y + cap_h + gap_below_caption
+    video_top = (caption_y + cap_h + gap_below_caption + 1) // 2 * 2   # even, like every other offset
     available_h = OUT_H - video_top
     if available_h < 10:
         raise RuntimeError("Not enough space for video in FULL mode.")
+    return {"caption_y": caption_y, "video_top": video_top, "available_h": available_h,
+            "logo_x": logo_margin_x, "logo_y": logo_margin_y}
 
-    filter_graph = (
-        f"[1:v]scale={OUT_W}:{available_h}:force_original_aspect_ratio=decrease[sv];"
-        f"[0:v][sv]overlay=x=(W-w)/2:y={video_top}[bgv];"
-        f"[bgv][2:v]overlay=x=(W-w)/2:y={caption_y}:format=auto[bgvcap];"
-        f"[3:v]scale=120:-1[logo];"
-        f"[bgvcap][logo]overlay=x={logo_margin_x}:y={logo_margin_y}:format=auto"
-    )
-
-    cmd = [
-        "ffmpeg","-y",
-        "-f","lavfi","-i", f"color={ACCENT}:size={OUT_W}x{OUT_H}:rate={fps}",
-        "-i", local_video_path,
-        "-loop","1","-i", str(caption_png),
-        "-i", logo_path,
-        "-filter_complex", filter_graph,
-        "-shortest",
-        *_cpu_vcodec_args(),
-        "-c:a","aac","-b:a","128k",
-        "-movflags","+faststart",
-        str(output_path)
-    ]
-    subprocess.check_call(cmd)
+def layout_mid(meta: dict, caption_size: tuple[int, int]) -> dict:
+    """MID: video at native size in the centre (oversized ones fitted), logo and caption over its upper part."""
+    geo = source_geometry(meta)
+    vis_w, vis_h = fit_size(geo["w"], geo["h"], OUT_W, OUT_H)
 
-def compose_mid(local_video_path: str, caption_png: Path, output_path: Path, logo_path: str):
-    meta = ffprobe_json(local_video_path)
-    fps = derive_fps(meta)
-    vstream = next(s for s in meta["streams"] if s["codec_type"]=="video")
-    src_w = int(vstream.get("width")); src_h = int(vstream.get("height"))
-
-    with Image.open(caption_png) as im: cap_w, cap_h = im.size
+    cap_w, cap_h = caption_size
 
-    vid_x = (OUT_W - src_w) // 2
-    vid_y = (OUT_H - src_h) // 2
+    vid_x = _even_offset(OUT_W - vis_w)
+    vid_y = _even_offset(OUT_H - vis_h)
 
     mid_logo_offset_y = 60
     mid_text_offset_y = 235
 
-    logo_x = vid_x + (src_w - 120) // 2
-    logo_y = vid_y + mid_logo_offset_y
+    return {"vid_x": vid_x, "vid_y": vid_y, "vis_w": vis_w, "vis_h": vis_h,
+            "logo_x": vid_x + (vis_w - 120) // 2, "logo_y": vid_y + mid_logo_offset_y,
+            "cap_x": vid_x + (vis_w - cap_w) // 2, "cap_y": vid_y + mid_text_offset_y}
+
+# -------- static layers: everything but the video, composed once with Pillow --------
+# FULL gets an opaque frame template (accent plate, logo, caption) that the scaled video is
+# overlaid onto; MID gets a small transparent sprite (logo + caption) laid over the padded
+# video. Both are cached by content in memory and as PNGs under TEMPLATE_DIR.
+TEMPLATE_DIR = CACHE_DIR / "templates"
+TEMPLATE_MEMORY_ITEMS = int(os.environ.get("TEMPLATE_MEMORY_ITEMS", "8"))   # a FULL template is ~8 MB
+TEMPLATE_DISK_MAX_BYTES = int(os.environ.get("TEMPLATE_DISK_MAX_BYTES", str(256 << 20)))
+_templates: OrderedDict[str, tuple[Image.Image, tuple[int, int]]] = OrderedDict()
+_template_lock = threading.Lock()
+
+def _accent_rgb() -> tuple[int, int, int]:
+    return tuple(int(ACCENT.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4))
+
+@lru_cache(maxsize=4)
+def _full_plate(logo_path: str, mtime_ns: int, logo_pos: tuple[int, int]) -> Image.Image:
+    # the caption-independent part of every FULL template: accent canvas and logo
+    plate = Image.new("RGBA", (OUT_W, OUT_H), _accent_rgb() + (255,))
+    plate.alpha_composite(_scaled_logo(logo_path, mtime_ns), logo_pos)
+    return plate
+
+def full_plate(logo_path: str, layout: dict) -> Image.Image:
+    return _full_plate(logo_path, os.stat(logo_path).st_mtime_ns, (layout["logo_x"], layout["logo_y"]))
+
+def _build_full_template(caption: Image.Image, layout: dict, logo_path: str) -> tuple[Image.Image, tuple[int, int]]:
+    plate = full_plate(logo_path, layout).copy()   # the caption sits below the logo, never under it
+    plate.alpha_composite(caption.convert("RGBA"), ((OUT_W - caption.width) // 2, layout["caption_y"]))
+    return plate, (0, 0)
+
+def _build_mid_sprite(caption: Image.Image, layout: dict, logo_path: str) -> tuple[Image.Image, tuple[int, int]]:
+    logo = scaled_logo(logo_path)
+    boxes = [(layout["logo_x"], layout["logo_y"], logo), (layout["cap_x"], layout["cap_y"], caption.convert("RGBA"))]
+    x0, y0 = min(x for x, _, _ in boxes), min(y for _, y, _ in boxes)
+    x1, y1 = max(x + im.width for x, _, im in boxes), max(y + im.height for _, y, im in boxes)
+    sprite = Image.new("RGBA", (x1 - x0, y1 - y0), (0, 0, 0, 0))
+    for x, y, im in boxes:   # logo first, caption on top, as the old overlay order
+        sprite.alpha_composite(im, (x - x0, y - y0))
+    return sprite, (x0, y0)
+
+def static_layer(design: str, caption: Image.Image, layout: dict, logo_path: str) -> tuple[Image.Image, tuple[int, int]]:
+    """(image, canvas position) of the still part of a layout, built once per content."""
+    key = hashlib.sha256(json.dumps({
+        "v": 1, "design": design, "layout": layout, "canvas": [OUT_W, OUT_H, ACCENT],
+        "caption": hashlib.sha1(caption.tobytes()).hexdigest(), "caption_size": caption.size,
+        "logo": file_digest(logo_path),
+    }, sort_keys=True).encode()).hexdigest()
+    with _template_lock:
+        hit = _templates.get(key)
+        if hit is not None:
+            _templates.move_to_end(key)
+            return hit
+    path = TEMPLATE_DIR / f"{key}.png"
+    try:
+        with Image.open(path) as im:
+            img = im.convert("RGBA")
+        pos = tuple(json.loads(im.info["pos"])) if "pos" in im.info else (0, 0)
+        os.utime(path)
+    except (FileNotFoundError, OSError, ValueError):
+        build = _build_mid_sprite if design == "mid" else _build_full_template
+        img, pos = build(caption, layout, logo_path)
+        _save_template(path, img, pos)
+    with _template_lock:
+        _templates[key] = (img, pos)
+        while len(_templates) > TEMPLATE_MEMORY_ITEMS:
+            _templates.popitem(last=False)
+    return img, pos
+
+def _save_template(path: Path, img: Image.Image, pos: tuple[int, int]):
+    TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("pos", json.dumps(list(pos)))
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    img.save(tmp, "PNG", compress_level=1, pnginfo=info)
+    os.replace(tmp, path)
+    files = []
+    for p in TEMPLATE_DIR.glob("*.png"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= TEMPLATE_DISK_MAX_BYTES:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+
+# -------- graphs --------
+def video_size(design: str, layout: dict, geo: dict) -> tuple[int, int]:
+    """On-canvas size of the source video: MID as laid out, FULL fitted (up or down) below the caption."""
+    if design == "mid":
+        return layout["vis_w"], layout["vis_h"]
+    return fit_size(geo["w"], geo["h"], OUT_W, layout["available_h"], upscale=True)
+
+def _source_chain(design: str, layout: dict, geo: dict, fps: int) -> str:
+    """
+    Filters applied to the decoded source before it meets its still layer. Frames are dropped
+    to the output rate and brought to their final size first, so nothing later (pad, overlay)
+    ever touches more pixels than end up on the canvas.
+    """
+    fit = _fit_filters(geo, *video_size(design, layout, geo))
+    if design == "mid":
+        L = layout
+        fit.append(f"pad={OUT_W}:{OUT_H}:{L['vid_x']}:{L['vid_y']}:color={ACCENT}")
+    return ",".join([f"fps={fps}", *fit])
 
-    cap_x = vid_x + (src_w - cap_w) // 2
-    cap_y = vid_y + mid_text_offset_y
+def _still_chain(design: str, layout: dict, video: str, still: str, pos: tuple[int, int], tag: str = "") -> str:
+    """
+    Final overlay of one output: `video` is the source after _source_chain, `still` the
+    static layer input. FULL loops its one-frame template as the background; MID lays the
+    sprite over the padded video (overlay holds a one-frame input on its last frame).
+    """
+    if design == "mid":
+        return f"{video}{still}overlay=x={pos[0]}:y={pos[1]}:format=auto"
+    # the plate is converted to yuv420p once, before looping, so the overlay stays in YUV
+    return (f"{still}format=yuv420p,setsar=1,loop=loop=-1:size=1[plate{tag}];"
+            f"[plate{tag}]{video}overlay=x=floor((W-w)/4)*2:y={layout['video_top']}:shortest=1")
+
+def compose_full(local_video_path: str, caption: Image.Image, output_path: Path, logo_path: str,
+                 timings: dict | None = None, on_progress=None):
+    with stage(timings, "probe"):
+        meta = probe_video(local_video_path)
+    fps = derive_fps(meta)
+    geo = source_geometry(meta)
+    layout = layout_full(caption.size, logo_path)
+    plate, pos = static_layer("full", caption, layout, logo_path)
+    filter_graph = (
+        f"[0:v]{_source_chain('full', layout, geo, fps)}[sv];"
+        + _still_chain("full", layout, "[sv]", "[1:v]", pos)
+    )
+    _encode(local_video_path, meta, fps, plate, filter_graph, output_path, timings, on_progress,
+            decode_args(geo, *video_size("full", layout, geo)))
 
+def compose_mid(local_video_path: str, caption: Image.Image, output_path: Path, logo_path: str,
+                timings: dict | None = None, on_progress=None):
+    with stage(timings, "probe"):
+        meta = probe_video(local_video_path)
+    fps = derive_fps(meta)
+    geo = source_geometry(meta)
+    layout = layout_mid(meta, caption.size)
+    sprite, pos = static_layer("mid", caption, layout, logo_path)
     filter_graph = (
-        f"[0:v][1:v]overlay=x={vid_x}:y={vid_y}[bgv];"
-        f"[3:v]scale=120:-1[logo];"
-        f"[bgv][logo]overlay=x={logo_x}:y={logo_y}[bgvlogo];"
-        f"[bgvlogo][2:v]overlay=x={cap_x}:y={cap_y}:format=auto"
+        f"[0:v]{_source_chain('mid', layout, geo, fps)}[bgv];"
+        + _still_chain("mid", layout, "[bgv]", "[1:v]", pos)
     )
+    _encode(local_video_path, meta, fps, sprite, filter_graph, output_path, timings, on_progress,
+            decode_args(geo, *video_size("mid", layout, geo)))
 
-    cmd = [
-        "ffmpeg","-y",
-        "-f","lavfi","-i", f"color={ACCENT}:size={OUT_W}x{OUT_H}:rate={fps}",
-        "-i", local_video_path,
-        "-loop","1","-i", str(caption_png),
-        "-i", logo_path,
-        "-filter_complex", filter_graph,
-        "-shortest",
-        *_cpu_vcodec_args(),
-        "-c:a","aac","-b:a","128k",
-        "-movflags","+faststart",
-        str(output_path)
-    ]
-    subprocess.check_call(cmd)
+def _variants_graph(layouts: list[tuple[str, dict, tuple[int, int]]], geo: dict, fps: int) -> str:
+    """
+    One graph for several outputs of the same source: the decoded video is split once per
+    distinct source chain (FULL layouts with the same video height share one scaler, all
+    MID layouts share one padded copy), and each output gets its own still overlay -> [out<k>].
+    Inputs: 0 source, 1..n still layers.
+    """
+    n = len(layouts)
+    groups: dict[str, list[int]] = {}
+    for k, (design, layout, _) in enumerate(layouts):
+        groups.setdefault(_source_chain(design, layout, geo, fps), []).append(k)
+
+    parts = ["[0:v]split=%d%s" % (len(groups), "".join(f"[src{g}]" for g in range(len(groups))))]
+    video = [""] * n
+    for g, (chain, members) in enumerate(groups.items()):
+        if len(members) == 1:
+            parts.append(f"[src{g}]{chain}[v{members[0]}]")
+        else:
+            parts.append(f"[src{g}]{chain},split={len(members)}" + "".join(f"[v{k}]" for k in members))
+        for k in members:
+            video[k] = f"[v{k}]"
+    for k, (design, layout, pos) in enumerate(layouts):
+        parts.append(_still_chain(design, layout, video[k], f"[{k + 1}:v]", pos, str(k)) + f"[out{k}]")
+    return ";".join(parts)
+
+def compose_variants(local_video_path: str, variants: list[tuple[str, Image.Image, Path]], logo_path: str,
+                     timings: dict | None = None, on_progress=None):
+    """
+    Render several (design, caption, output_path) variants of one source in a single ffmpeg
+    process: one decode, shared scaling, one x264 encoder per output. The encoders already
+    run side by side, so long sources aren't segmented here.
+    """
+    with stage(timings, "probe"):
+        meta = probe_video(local_video_path)
+    fps = derive_fps(meta)
+    geo = source_geometry(meta)
+    layouts, stills = [], []
+    for design, cap, _ in variants:
+        layout = layout_mid(meta, cap.size) if design == "mid" else layout_full(cap.size, logo_path)
+        still, pos = static_layer(design, cap, layout, logo_path)
+        layouts.append((design, layout, pos))
+        stills.append(still)
+    duration = media_duration(meta)
+
+    still_args, feeds = _rgba_inputs(stills, fps)
+    # this render's share of the host, split once among its variants' encoders
+    threads = max(1, encoder_threads(ENCODER_PROFILES[ENCODER_PROFILE]) // len(variants))
+    # decode for the largest picture any variant shows
+    sizes = [video_size(design, layout, geo) for design, layout, _ in layouts]
+    decode = decode_args(geo, max(w for w, _ in sizes), max(h for _, h in sizes))
+    cmd = ["ffmpeg","-y","-nostdin",
+           *decode, "-i", local_video_path,
+           *still_args,
+           "-filter_complex", _variants_graph(layouts, geo, fps)]
+    for k, (_, _, output_path) in enumerate(variants):
+        cmd += ["-map", f"[out{k}]", "-map", "0:a?", "-shortest",
+                *_cpu_vcodec_args(threads),
+                "-c:a","aac","-b:a","128k",
+                "-movflags","+faststart",
+                str(output_path)]
+    report = _progress_reporter(on_progress, duration)
+    with stage(timings, "encode"):
+        _run_ffmpeg(cmd, feeds, report)
+
+# -------- adaptive streaming: an HLS ladder from one encode --------
+# format "hls" renders the same frame once, splits it after compositing and encodes every
+# rung of HLS_RUNGS side by side (capped CRF, keyframes every HLS_SEGMENT_SECONDS so all
+# rungs cut their fMP4 segments at the same instants and players can switch between them).
+# Audio is encoded once, as its own rendition. The output is a directory <name>.hls/ with
+# HLS_MASTER, one playlist + init segment + .m4s segments per rung, served as plain files.
+HLS_LADDER = {"1080p": (1080, 1920, 6000), "720p": (720, 1280, 3000), "480p": (480, 854, 1200)}  # w, h, maxrate kb/s
+HLS_RUNGS = [r.strip() for r in os.environ.get("HLS_RUNGS", "1080p,720p,480p").split(",") if r.strip()]
+HLS_SEGMENT_SECONDS = int(os.environ.get("HLS_SEGMENT_SECONDS", "4"))
+HLS_MASTER = "master.m3u8"
+OUTPUT_FORMATS = {"mp4": ".mp4", "hls": ".hls"}   # format -> output name suffix
+if not HLS_RUNGS or any(r not in HLS_LADDER for r in HLS_RUNGS):
+    raise RuntimeError(f"HLS_RUNGS must name rungs of {sorted(HLS_LADDER)}")
+
+def compose_hls(local_video_path: str, caption: Image.Image, design: str, out_dir: Path, logo_path: str,
+                timings: dict | None = None, on_progress=None):
+    """Render one (design, caption) as an HLS ladder into the existing directory `out_dir`."""
+    with stage(timings, "probe"):
+        meta = probe_video(local_video_path)
+    fps = derive_fps(meta)
+    geo = source_geometry(meta)
+    layout = layout_mid(meta, caption.size) if design == "mid" else layout_full(caption.size, logo_path)
+    still, pos = static_layer(design, caption, layout, logo_path)
+    rungs = [(name, *HLS_LADDER[name]) for name in HLS_RUNGS]
+    parts = [f"[0:v]{_source_chain(design, layout, geo, fps)}[sv]",
+             _still_chain(design, layout, "[sv]", "[1:v]", pos)
+             + f",split={len(rungs)}" + "".join(f"[c{k}]" for k in range(len(rungs)))]
+    video = []
+    for k, (_, w, h, _) in enumerate(rungs):
+        if (w, h) == (OUT_W, OUT_H):
+            video.append(f"[c{k}]")
+        else:
+            parts.append(f"[c{k}]scale={w}:{h}[r{k}]")
+            video.append(f"[r{k}]")
+    audio = any(st.get("codec_type") == "audio" for st in meta.get("streams", []))
+    gop = str(fps * HLS_SEGMENT_SECONDS)
+
+    still_args, feeds = _rgba_inputs([still], fps)
+    # -threads applies to each rung's encoder: split this render's share of the host among them
+    threads = max(1, encoder_threads(ENCODER_PROFILES[ENCODER_PROFILE]) // len(rungs))
+    cmd = ["ffmpeg","-y","-nostdin",
+           *decode_args(geo, *video_size(design, layout, geo)), "-i", local_video_path,
+           *still_args,
+           "-filter_complex", ";".join(parts)]
+    streams = []
+    for k, (name, _, _, kbps) in enumerate(rungs):
+        cmd += ["-map", video[k], f"-maxrate:v:{k}", f"{kbps}k", f"-bufsize:v:{k}", f"{2 * kbps}k"]
+        streams.append(f"v:{k},agroup:aud,name:{name}" if audio else f"v:{k},name:{name}")
+    if audio:
+        cmd += ["-map", "0:a:0", "-c:a","aac","-b:a","128k"]
+        streams.append("a:0,agroup:aud,name:audio,default:yes")
+    cmd += [*_cpu_vcodec_args(threads), "-g", gop, "-keyint_min", gop, "-sc_threshold", "0",
+            "-shortest",
+            "-f","hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type","vod",
+            "-hls_segment_type","fmp4", "-hls_flags","independent_segments",
+            "-hls_fmp4_init_filename","init.mp4", "-master_pl_name", HLS_MASTER,
+            "-var_stream_map", " ".join(streams),
+            "-hls_segment_filename", str(out_dir / "%v" / "seg_%03d.m4s"),
+            str(out_dir / "%v" / "index.m3u8")]
+    duration = media_duration(meta)
+    report = _progress_reporter(on_progress, duration)
+    with stage(timings, "encode"):
+        _run_ffmpeg(cmd, feeds, report)
+
+DRAFT_KINDS = {"still": "_draft.jpg", "clip": "_draft.mp4"}   # kind -> output name suffix
+
+def compose_draft(local_video_path: str, caption: Image.Image, design: str, kind: str, output_path: Path,
+                  logo_path: str, timings: dict | None = None):
+    """
+    Same layout, static layer and graph as compose_full/compose_mid, so caption box and logo
+    land exactly where the full render puts them, cut short: "still" is one full-size JPEG
+    frame DRAFT_STILL_AT seconds in, "clip" the first DRAFT_SECONDS at 1/DRAFT_SCALE size,
+    DRAFT_FPS and x264 ultrafast.
+    """
+    with stage(timings, "probe"):
+        meta = probe_video(local_video_path)
+    geo = source_geometry(meta)
+    layout = layout_mid(meta, caption.size) if design == "mid" else layout_full(caption.size, logo_path)
+    still, pos = static_layer(design, caption, layout, logo_path)
+    duration = media_duration(meta)
+    fps = min(DRAFT_FPS, derive_fps(meta)) if kind == "clip" else derive_fps(meta)
+    graph = (f"[0:v]{_source_chain(design, layout, geo, fps)}[sv];"
+             + _still_chain(design, layout, "[sv]", "[1:v]", pos))
+    still_args, feeds = _rgba_inputs([still], fps)
+    decode = decode_args(geo, *video_size(design, layout, geo))
+    if kind == "still":
+        at = min(DRAFT_STILL_AT, duration / 2)
+        cmd = ["ffmpeg","-y","-nostdin", "-ss", f"{at:.3f}", *decode, "-i", local_video_path, *still_args,
+               "-filter_complex", graph, "-frames:v","1", "-q:v","3", "-update","1", str(output_path)]
+    else:
+        w, h = OUT_W // DRAFT_SCALE // 2 * 2, OUT_H // DRAFT_SCALE // 2 * 2
+        cmd = ["ffmpeg","-y","-nostdin", "-t", f"{DRAFT_SECONDS:.3f}", *decode, "-i", local_video_path, *still_args,
+               "-filter_complex", graph + f",scale={w}:{h}:flags=bilinear",
+               "-shortest",
+               "-c:v","libx264","-preset","ultrafast","-crf","28","-pix_fmt","yuv420p",
+               "-c:a","aac","-b:a","64k",
+               "-movflags","+faststart",
+               str(output_path)]
+    with stage(timings, "draft"):
+        _run_ffmpeg(cmd, feeds)
 
 # -------------------- filenames & cleanup --------------------
 def safe_filename_from_text(text: str) -> str:
@@ -313,21 +1654,1048 @@ def safe_filename_from_text(text: str) -> str:
     if not s: s = "video"
     return f"{s}.mp4"
 
+def reserve_output_path(text: str, suffix: str = ".mp4") -> Path:
+    """
+    Pick a unique output path for `text` and create it empty (a directory for ".hls") so
+    concurrent jobs can't collide.
+    """
+    stem = Path(safe_filename_from_text(text)).stem
+    ts = time.strftime("%Y%m%d_%H%M%S")
+    candidates = [f"{stem}{suffix}", f"{stem}_{ts}{suffix}"] + [f"{stem}_{ts}_{k}{suffix}" for k in range(2, 1000)]
+    for name in candidates:
+        p = OUTPUTS_DIR / name
+        try:
+            if suffix == ".hls":
+                p.mkdir()
+            else:
+                with open(p, "x"):
+                    pass
+            return p
+        except FileExistsError:
+            continue
+    raise RuntimeError("Could not reserve an output filename.")
+
+# -------------------- Output retention --------------------
+# Outputs (files, or the directories of HLS ladders) are tracked in the shared store's
+# outputs table (name -> size, last use, downloads, expiry), so every process sees the same
+# lifetimes and the same total against OUTPUTS_MAX_BYTES; outputs already on disk are
+# picked up at startup. Nothing is deleted while it's held (being rendered or served): a
+# holder keeps a shared flock on the output, and a sweeper, in whichever process, only
+# removes an output it can lock exclusively. Each download extends an output's lifetime,
+# up to OUTPUT_TTL_MAX_FACTOR x TTL_SECONDS.
+OUTPUT_TOUCH_INTERVAL = 60   # seconds; views closer together than this don't rewrite the row
+_retention_lock = threading.Lock()
+_holds: dict[str, list] = {}   # name -> [fd holding the shared flock, refs] in this process
+_retention_wake = threading.Event()
+
+def output_bytes(path: Path) -> int:
+    """Size of an output: the file, or every file in an HLS directory."""
+    if path.is_dir():
+        return _disk_bytes(p for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+def remove_output(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+def _reconcile_outputs():
+    """Track outputs on disk that the store doesn't know yet, and forget rows whose output is gone."""
+    on_disk = {p.name: p for p in [*OUTPUTS_DIR.glob("*.mp4"), *OUTPUTS_DIR.glob("*.png"), *OUTPUTS_DIR.glob("*.jpg"),
+                                   *OUTPUTS_DIR.glob("*.hls")]}
+    known = {name for (name,) in _db().execute("SELECT name FROM outputs")}
+    new = []
+    for name in on_disk.keys() - known:
+        try:
+            used = on_disk[name].stat().st_mtime
+            new.append((name, output_bytes(on_disk[name]), used, used + TTL_SECONDS))
+        except FileNotFoundError:
+            continue
+    gone = [(name,) for name in known - on_disk.keys()]
+    with _db_tx() as db:
+        db.executemany("INSERT OR IGNORE INTO outputs (name, size, used, downloads, expires) VALUES (?, ?, ?, 0, ?)", new)
+        db.executemany("DELETE FROM outputs WHERE name = ?", gone)
+        db.executemany("DELETE FROM render_cache WHERE output = ?", gone)
+
+def output_register(name: str):
+    """Start tracking a finished output (its size counts toward OUTPUTS_MAX_BYTES from now on)."""
+    size = output_bytes(OUTPUTS_DIR / name)
+    now = time.time()
+    with _db_tx() as db:
+        db.execute("INSERT INTO outputs (name, size, used, downloads, expires) VALUES (?, ?, ?, 0, ?) "
+                   "ON CONFLICT (name) DO UPDATE SET size = excluded.size, used = excluded.used, "
+                   "expires = excluded.used + ? * MIN(1 + downloads, ?)",
+                   (name, size, now, now + TTL_SECONDS, TTL_SECONDS, OUTPUT_TTL_MAX_FACTOR))
+    if outputs_bytes() > OUTPUTS_MAX_BYTES:
+        _retention_wake.set()
+
+def output_touch(name: str, download: bool = False) -> bool:
+    """Mark an output as used (a cache hit or a download); False if it's no longer kept."""
+    now = time.time()
+    row = _db().execute("SELECT used FROM outputs WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return False
+    if download or now - row[0] > OUTPUT_TOUCH_INTERVAL:
+        with _db_tx() as db:
+            db.execute("UPDATE outputs SET used = ?, downloads = downloads + ?, "
+                       "expires = ? + ? * MIN(1 + downloads + ?, ?) WHERE name = ?",
+                       (now, int(download), now, TTL_SECONDS, int(download), OUTPUT_TTL_MAX_FACTOR, name))
+    return True
+
+def output_acquire(name: str):
+    """
+    Hold an output: no process evicts it until the matching output_release. Raises
+    FileNotFoundError if it's already gone.
+    """
+    path = OUTPUTS_DIR / name
+    with _retention_lock:
+        hold = _holds.get(name)
+        if hold is None:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)   # waits out a sweeper that is deleting it right now
+                if os.stat(path).st_ino != os.fstat(fd).st_ino:
+                    raise FileNotFoundError(errno.ENOENT, "output was replaced", str(path))
+            except BaseException:
+                os.close(fd)
+                raise
+            hold = _holds[name] = [fd, 0]
+        hold[1] += 1
+
+def output_release(name: str):
+    with _retention_lock:
+        hold = _holds.get(name)
+        if hold is not None:
+            hold[1] -= 1
+            if not hold[1]:
+                os.close(hold[0])
+                del _holds[name]
+
+def output_forget(name: str):
+    """Stop tracking an output that was removed outside the sweeper (e.g. a failed render)."""
+    with _db_tx() as db:
+        db.execute("DELETE FROM outputs WHERE name = ?", (name,))
+        db.execute("DELETE FROM render_cache WHERE output = ?", (name,))
+
+def outputs_bytes() -> int:
+    return int(_db().execute("SELECT TOTAL(size) FROM outputs").fetchone()[0])
+
+SWEEP_BATCH = 64   # outputs claimed per store transaction by a sweep
+
+def _evict(db: sqlite3.Connection, name: str, claimed: list) -> bool:
+    """
+    Claim an output no process holds: take its exclusive flock and drop its row and render
+    cache entries (caller is in _db_tx). The file itself is removed by _evicting, after commit.
+    """
+    path = OUTPUTS_DIR / name
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        fd = None   # already gone: just forget it
+    if fd is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        claimed.append((fd, path))
+    db.execute("DELETE FROM outputs WHERE name = ?", (name,))
+    db.execute("DELETE FROM render_cache WHERE output = ?", (name,))
+    return True
+
+@contextmanager
+def _evicting():
+    """
+    One sweep batch: yields (db, evict) inside a store transaction, where evict(name) is
+    _evict. The outputs it claimed are deleted once that has committed, so rmtree and unlink
+    don't hold the store's write lock; their flocks keep holders out until then.
+    """
+    claimed: list[tuple[int, Path]] = []
+    try:
+        with _db_tx() as db:
+            yield db, lambda name: _evict(db, name, claimed)
+    except BaseException:
+        for fd, _ in claimed:
+            os.close(fd)
+        raise
+    for fd, path in claimed:
+        try:
+            remove_output(path)
+        finally:
+            os.close(fd)
+
+def _disk_short(reclaimed: int) -> bool:
+    return shutil.disk_usage(OUTPUTS_DIR).free + reclaimed < OUTPUTS_MIN_FREE_BYTES
+
+def sweep_outputs(now: float):
+    """
+    Evict expired outputs, then the soonest-to-expire ones while over OUTPUTS_MAX_BYTES
+    or while the disk has less than OUTPUTS_MIN_FREE_BYTES free. Held outputs stay.
+    Candidates are claimed SWEEP_BATCH at a time, each batch in its own transaction.
+    """
+    expired = [name for (name,) in _db().execute("SELECT name FROM outputs WHERE expires <= ? ORDER BY expires",
+                                                 (now,))]
+    for i in range(0, len(expired), SWEEP_BATCH):
+        with _evicting() as (db, evict):
+            for name in expired[i:i + SWEEP_BATCH]:
+                # a download may have extended it since the list was read
+                if db.execute("SELECT 1 FROM outputs WHERE name = ? AND expires <= ?", (name, now)).fetchone():
+                    evict(name)
+    total = outputs_bytes()
+    reclaimed = 0   # unlinks are visible to disk_usage, but an open download keeps blocks alive
+    if not (total > OUTPUTS_MAX_BYTES or _disk_short(0)):
+        return
+    rows = _db().execute("SELECT name, size FROM outputs ORDER BY expires").fetchall()
+    for i in range(0, len(rows), SWEEP_BATCH):
+        if total <= OUTPUTS_MAX_BYTES and not _disk_short(reclaimed):
+            break
+        with _evicting() as (db, evict):
+            for name, size in rows[i:i + SWEEP_BATCH]:
+                if total <= OUTPUTS_MAX_BYTES and not _disk_short(reclaimed):
+                    break
+                if evict(name):
+                    total -= size
+                    reclaimed += size
+
 def cleanup_outputs():
     while True:
         try:
             now = time.time()
-            for p in OUTPUTS_DIR.glob("*.mp4"):
-                if now - p.stat().st_mtime > TTL_SECONDS:
-                    p.unlink(missing_ok=True)
-            for p in OUTPUTS_DIR.glob("*.png"):
-                if now - p.stat().st_mtime > TTL_SECONDS:
-                    p.unlink(missing_ok=True)
+            sweep_outputs(now)
+            sweep_sources()
+            prune_jobs(now)
+            prune_batches()
+            sweep_spool(now)
         except Exception:
+            app.logger.exception("cleanup pass failed")
+        _retention_wake.wait(CLEAN_INTERVAL)
+        _retention_wake.clear()
+
+# -------------------- Render cache --------------------
+# key -> output filename in OUTPUTS_DIR, in the shared store's render_cache table, so every
+# process (and a restart) sees the same hits; rows go with their output when it's evicted.
+_cache_lock = threading.Lock()
+_digests: dict[tuple, str] = {}
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's bytes, memoised by file identity."""
+    st = os.stat(path)
+    ident = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        if ident in _digests:
+            return _digests[ident]
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    with _cache_lock:
+        _digests[ident] = digest
+    return digest
+
+def remember_digest(path: str, digest: str):
+    """Record a digest computed while the file was being written, so it's never re-read."""
+    st = os.stat(path)
+    with _cache_lock:
+        _digests[(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)] = digest
+
+def render_cache_key(local_video: str, text: str, design: str, logo_path: str, output_format: str = "mp4") -> str:
+    parts = {
+        "v": RENDER_CACHE_VERSION,
+        "source": file_digest(local_video),
+        "text": text,
+        "design": design,
+        "logo": file_digest(logo_path),
+        "caption": CAPTION_STYLE,
+        "canvas": [OUT_W, OUT_H, ACCENT],
+        "encoder": encoder_cache_key(),
+    }
+    if output_format == "hls":   # MP4 keys stay as they were
+        parts["hls"] = [[HLS_LADDER[r] for r in HLS_RUNGS], HLS_SEGMENT_SECONDS]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def draft_cache_key(local_video: str, text: str, design: str, kind: str, logo_path: str) -> str:
+    settings = [kind, DRAFT_SECONDS, DRAFT_STILL_AT, DRAFT_SCALE, DRAFT_FPS]
+    return hashlib.sha256(json.dumps(["draft", render_cache_key(local_video, text, design, logo_path),
+                                      settings]).encode()).hexdigest()
+
+def render_cache_get(key: str) -> str | None:
+    """Name of a finished output for `key`, marked as just used; None on a miss."""
+    row = _db().execute("SELECT render_cache.output FROM render_cache JOIN outputs ON outputs.name = render_cache.output "
+                        "WHERE key = ?", (key,)).fetchone()
+    if row is None or not output_touch(row[0]):   # refreshes its TTL
+        return None
+    return row[0]
+
+def render_cache_put(key: str, name: str):
+    with _db_tx() as db:
+        db.execute("INSERT OR REPLACE INTO render_cache (key, output) VALUES (?, ?)", (key, name))
+
+def render_cache_peek(source: str, text: str, design: str, output_format: str = "mp4") -> str | None:
+    """
+    The cached output for a render that can be answered at submit time: an upload (its
+    digest was taken as it arrived) or a link whose source is cached already. None otherwise.
+    """
+    local = _cached_source(source) if is_url(source) else source
+    if not local or not os.path.isfile(local):
+        return None
+    return render_cache_get(render_cache_key(local, text, design, LOGO_PATH, output_format))
+
+@contextmanager
+def render_key_lock(key: str):
+    """
+    Serialise renders of the same key across every process, so a double-submit waits for
+    the first and then hits. The lock is a lease row the holder's heartbeat keeps renewing;
+    a holder that died stops renewing, and its lease lapses after JOB_LEASE_SECONDS.
+    """
+    owner = f"{worker_id()}:{threading.get_ident()}"
+    while True:
+        now = time.time()
+        with _db_tx() as db:
+            taken = db.execute("INSERT INTO render_leases (key, owner, until) VALUES (?, ?, ?) "
+                               "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, until = excluded.until "
+                               "WHERE render_leases.until < ?",
+                               (key, owner, now + JOB_LEASE_SECONDS, now)).rowcount
+        if taken:
+            break
+        time.sleep(JOB_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        with _db_tx() as db:
+            db.execute("DELETE FROM render_leases WHERE key = ? AND owner = ?", (key, owner))
+
+_reconcile_outputs()
+
+# -------------------- Render jobs (durable queue + worker threads) --------------------
+# One job per item, kept in a SQLite store (JOB_DB) that every server process, and any
+# `python app.py worker`, shares. Jobs rendered together (a variant group, a draft) form a
+# task. Worker threads claim a task under a lease; a heartbeat renews the leases of every
+# task this process runs, and a task whose lease lapses (worker killed, container
+# restarted) is claimed again by anyone, up to JOB_MAX_ATTEMPTS. POST /render only stores
+# the inputs and enqueues; /jobs/<id> reads progress back from the store.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "30"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))   # idle workers check for others' submissions
+JOB_WORKERS = os.environ.get("JOB_WORKERS", "1") != "0"   # 0: only queue (web nodes beside `python app.py worker` ones)
+_jobs_finished = threading.Condition()   # wakes local waiters early; other processes' jobs are polled
+_work_ready = {"render": threading.Event(), "draft": threading.Event()}
+_worker_nonce = os.urandom(3).hex()
+_workers_pid = 0
+
+def worker_id() -> str:
+    """host:pid:nonce of this process, the lease owner of the tasks it runs."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_worker_nonce}"
+
+def _new_job(source: str, text: str, design: str, tmp_dir: str = "", draft: str | None = None,
+             client: str = "", cost: float = 0.0, output_format: str = "mp4", timings: dict | None = None) -> dict:
+    return {
+        "id": os.urandom(8).hex(), "status": "queued", "design": design, "format": output_format, "text": text,
+        "source": source, "tmp_dir": tmp_dir, "output": None, "error": None, "client": client, "cost": cost,
+        "created": time.time(), "started": None, "finished": None, "timings": dict(timings or {}), "cached": False,
+        "progress": None, "eta": None, "fps": None, "speed": None, "media_duration": None,
+        "draft": draft, "approved": None,
+    }
+
+def _insert_task(db: sqlite3.Connection, kind: str, jobs: list[dict]):
+    # jobs that are done already (render cache hits) go in as a task no worker claims
+    task_id = os.urandom(8).hex()
+    state = "queued" if any(j["status"] == "queued" for j in jobs) else "finished"
+    db.execute("INSERT INTO tasks (id, kind, job_ids, state, created) VALUES (?, ?, ?, ?, ?)",
+               (task_id, kind, json.dumps([j["id"] for j in jobs]), state, time.time()))
+    db.executemany("INSERT INTO jobs (id, task, status, finished, data) VALUES (?, ?, ?, ?, ?)",
+                   [(j["id"], task_id, j["status"], j["finished"], json.dumps(j)) for j in jobs])
+
+def _patch_job(db: sqlite3.Connection, job_id: str, fields: dict) -> dict | None:
+    row = db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = {**json.loads(row[0]), **fields}
+    db.execute("UPDATE jobs SET status = ?, finished = ?, data = ? WHERE id = ?",
+               (job["status"], job["finished"], json.dumps(job), job_id))
+    return job
+
+def _update_job(job_id: str, **fields):
+    with _db_tx() as db:
+        _patch_job(db, job_id, fields)
+    if fields.get("status") in ("done", "failed"):
+        with _jobs_finished:
+            _jobs_finished.notify_all()
+
+def get_job(job_id: str) -> dict | None:
+    row = _db().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def get_jobs(job_ids: list[str]) -> dict[str, dict]:
+    rows = _db().execute(f"SELECT id, data FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", job_ids)
+    return {job_id: json.loads(data) for job_id, data in rows}
+
+def _claim_task(kind: str) -> dict | None:
+    """Lease the oldest queued task of `kind`, or one whose lease lapsed; None if there's none."""
+    now = time.time()
+    claimable = ("FROM tasks WHERE kind = ? AND (state = 'queued' OR (state = 'running' AND lease_until < ?)) "
+                 "ORDER BY created LIMIT 1")
+    if _db().execute("SELECT 1 " + claimable, (kind, now)).fetchone() is None:
+        return None   # checked outside a write transaction, so idle workers don't take the lock
+    with _db_tx() as db:
+        while True:
+            row = db.execute("SELECT id, job_ids, attempts, state " + claimable, (kind, now)).fetchone()
+            if row is None:
+                return None
+            task_id, job_ids, attempts, state = row
+            job_ids = json.loads(job_ids)
+            if attempts >= JOB_MAX_ATTEMPTS:
+                # every worker that took it died with it: fail what's left rather than loop forever
+                for job_id in job_ids:
+                    job = get_job(job_id)
+                    if job and job["status"] not in ("done", "failed"):
+                        _patch_job(db, job_id, {"status": "failed", "finished": now,
+                                                "error": f"abandoned after {attempts} attempts"})
+                db.execute("UPDATE tasks SET state = 'finished', lease_owner = NULL WHERE id = ?", (task_id,))
+                continue
+            db.execute("UPDATE tasks SET state = 'running', attempts = attempts + 1, lease_owner = ?, "
+                       "lease_until = ? WHERE id = ?", (worker_id(), now + JOB_LEASE_SECONDS, task_id))
+            break
+    if state == "running":
+        app.logger.warning("task %s: lease lapsed, retrying (attempt %d)", task_id, attempts + 1)
+    return {"id": task_id, "job_ids": job_ids}
+
+def _finish_task(task_id: str):
+    with _db_tx() as db:
+        db.execute("UPDATE tasks SET state = 'finished', lease_owner = NULL WHERE id = ? AND lease_owner = ?",
+                   (task_id, worker_id()))
+
+def _heartbeat():
+    while True:
+        time.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            with _db_tx() as db:
+                db.execute("UPDATE tasks SET lease_until = ? WHERE state = 'running' AND lease_owner = ?",
+                           (time.time() + JOB_LEASE_SECONDS, worker_id()))
+                prefix = worker_id() + ":"   # render_key_lock owners are worker_id():thread
+                db.execute("UPDATE render_leases SET until = ? WHERE substr(owner, 1, ?) = ?",
+                           (time.time() + JOB_LEASE_SECONDS, len(prefix), prefix))
+        except sqlite3.Error:
+            app.logger.exception("lease heartbeat failed")
+
+def submit_render_group(source: str, items: list[tuple[str, str]], tmp_dir: str = "",
+                        client: str = "", duration: float | None = None, output_format: str = "mp4",
+                        timings: dict | None = None) -> list[str]:
+    """
+    Queue several (text, design) renders of one source as a single task, so they share
+    one decode (compose_variants). `tmp_dir` (if any) is removed once the task finishes.
+    `client` and the source's `duration` (if known yet) feed admission control;
+    `output_format` is one of OUTPUT_FORMATS; `timings` are stages already spent on the
+    source (an upload's probe). Items already in the render cache (see render_cache_peek)
+    are done on return and never reach a worker.
+    """
+    made, jobs, hits = [], [], []
+    for text, design in items:
+        job = _new_job(source, text, design, tmp_dir, client=client, output_format=output_format,
+                       cost=predict_cost(duration, design, output_format), timings=timings)
+        with stage(job["timings"], "hash"):
+            cached = render_cache_peek(source, text, design, output_format)
+        if cached:
+            now = time.time()
+            job.update(status="done", tmp_dir="", output=cached, cached=True, progress=1.0, eta=0.0,
+                       started=now, finished=now)
+        else:
+            job["timings"] = dict(timings or {})   # the worker times its own cache lookup
+        (hits if cached else jobs).append(job)
+        made.append(job)
+    if jobs and is_url(source):
+        prefetch_source(source)   # download now, overlapping with renders already queued
+    with _db_tx() as db:
+        for group in (hits, jobs):
+            if group:
+                _insert_task(db, "render", group)
+    for job in hits:
+        log_render_job(job, "cached")
+    if jobs:
+        _work_ready["render"].set()
+    elif tmp_dir:
+        shutil.rmtree(tmp_dir, ignore_errors=True)   # every item was a hit: nothing will read the upload
+    return [j["id"] for j in made]
+
+def submit_render_job(source: str, text: str, design: str, tmp_dir: str = "", client: str = "",
+                      duration: float | None = None, output_format: str = "mp4", timings: dict | None = None) -> str:
+    """Queue one item for rendering. `tmp_dir` (if any) is removed once the job finishes."""
+    return submit_render_group(source, [(text, design)], tmp_dir, client, duration, output_format, timings)[0]
+
+def _run_render_group(job_ids: list[str]):
+    # a retried task skips what its previous worker already finished
+    jobs = [j for j in get_jobs(job_ids).values() if j["status"] not in ("done", "failed")]
+    if not jobs:
+        return
+    job_ids = [j["id"] for j in jobs]
+    for name in {j["output"] for j in jobs if j["output"]}:
+        remove_output(OUTPUTS_DIR / name)   # half-written by a worker that died
+    source, output_format = jobs[0]["source"], jobs[0].get("format", "mp4")
+    for job_id in job_ids:
+        _update_job(job_id, status="running", started=time.time())
+    timings: dict[str, float] = dict(jobs[0]["timings"])   # stages spent at submit (an upload's probe)
+    pending = list(job_ids)
+    outputs: dict[str, Path] = {}   # cache key -> reserved output
+    try:
+        local_video = fetch_source(source, timings)
+        with stage(timings, "hash"):
+            keys = {j["id"]: render_cache_key(local_video, j["text"], j["design"], LOGO_PATH, output_format)
+                    for j in jobs}
+
+        with ExitStack() as held:
+            for key in sorted(set(keys.values())):   # fixed order: groups can't deadlock on shared keys
+                held.enter_context(render_key_lock(key))
+            misses: dict[str, list[dict]] = {}
+            for job in jobs:
+                cached = render_cache_get(keys[job["id"]])
+                if cached:
+                    _update_job(job["id"], status="done", output=cached, cached=True,
+                                finished=time.time(), timings=dict(timings))
+                    log_render_job(get_job(job["id"]), "cached")
+                    pending.remove(job["id"])
+                else:
+                    misses.setdefault(keys[job["id"]], []).append(job)
+            if not misses:
+                return
+
+            # Caption -> in-memory RGBA (Pillow), piped straight into ffmpeg
+            with stage(timings, "caption"):
+                captions = {key: render_caption_image(same[0]["text"], **CAPTION_STYLE)
+                            for key, same in misses.items()}
+
+            # Compose (CPU only); identical requests in the group share one output
+            for key, same in misses.items():
+                outputs[key] = out_path = reserve_output_path(same[0]["text"], OUTPUT_FORMATS[output_format])
+                output_acquire(out_path.name)
+                for job in same:
+                    _update_job(job["id"], output=out_path.name)
+
+            last = [0.0]
+
+            def progress(done, total, *rates):
+                # each write is a store transaction: at most one per PROGRESS_INTERVAL, plus the last
+                now = time.monotonic()
+                if now - last[0] < PROGRESS_INTERVAL and not (total and done >= total):
+                    return
+                last[0] = now
+                for job_id in pending:
+                    report_progress(job_id, done, total, *rates)
+
+            if output_format == "hls":   # each ladder already runs its rungs' encoders side by side
+                for key, same in misses.items():
+                    compose_hls(local_video, captions[key], same[0]["design"], outputs[key], LOGO_PATH,
+                                timings=timings, on_progress=progress)
+            elif len(misses) == 1:
+                [(key, same)] = misses.items()
+                compose = compose_mid if same[0]["design"] == "mid" else compose_full
+                compose(local_video, captions[key], outputs[key], LOGO_PATH, timings=timings, on_progress=progress)
+            else:
+                compose_variants(local_video, [(same[0]["design"], captions[key], outputs[key])
+                                               for key, same in misses.items()],
+                                 LOGO_PATH, timings=timings, on_progress=progress)
+            for key, out_path in outputs.items():
+                output_register(out_path.name)
+                render_cache_put(key, out_path.name)
+        for job_id in pending:
+            _update_job(job_id, status="done", progress=1.0, eta=0.0, finished=time.time(), timings=dict(timings),
+                        **encode_stats(get_job(job_id), timings))
+            log_render_job(get_job(job_id), "done")
+    except Exception as e:
+        app.logger.exception("render job(s) %s failed", ", ".join(pending))
+        for out_path in outputs.values():
+            remove_output(out_path)
+            output_forget(out_path.name)
+        for job_id in pending:
+            _update_job(job_id, status="failed", output=None, error=str(e) or e.__class__.__name__,
+                        finished=time.time(), timings=dict(timings))
+            # stage() records on the way out too, so the last stage timed is the one that raised
+            log_render_job(get_job(job_id), "failed", failed_stage=next(reversed(timings), "start"))
+    finally:
+        for out_path in outputs.values():
+            output_release(out_path.name)
+        if jobs[0]["tmp_dir"] and os.path.isdir(jobs[0]["tmp_dir"]):
+            shutil.rmtree(jobs[0]["tmp_dir"], ignore_errors=True)
+
+def log_render_job(job: dict, result: str, failed_stage: str | None = None):
+    """One structured log line per finished job, plus its stage histograms and counters."""
+    for name, seconds in job["timings"].items():
+        metric_observe("render_stage_seconds", seconds, stage=name)
+    metric_inc("renders_total", design=job["design"], kind=job["draft"] or "render", result=result)
+    if failed_stage:
+        metric_inc("render_failures_total", stage=failed_stage)
+    record = {"event": "render_job", "job": job["id"], "design": job["design"], "draft": job["draft"], "result": result,
+              "output": job["output"], "queued_s": round((job["started"] or job["created"]) - job["created"], 3),
+              "stages": {k: round(v, 3) for k, v in job["timings"].items()},
+              "speed": job["speed"], "media_duration": job["media_duration"]}
+    if failed_stage:
+        record.update(failed_stage=failed_stage, error=job["error"])
+    app.logger.info(json.dumps(record))
+
+PROGRESS_INTERVAL = 1.0   # seconds between a job's progress writes (ffmpeg reports every 0.5 s)
+
+def report_progress(job_id: str, done: float, total: float, fps: float, speed: float):
+    _update_job(job_id,
+                progress=round(done / total, 4) if total else None,
+                eta=round((total - done) / speed, 1) if total and speed else None,
+                fps=fps, speed=speed, media_duration=total or None)
+
+def encode_stats(job: dict, timings: dict) -> dict:
+    """Throughput of the finished encode in media seconds per wall second (ffmpeg's last fps is already an average)."""
+    wall = timings.get("encode", 0.0) + timings.get("concat", 0.0)
+    duration = job.get("media_duration")
+    return {"speed": round(duration / wall, 3)} if wall and duration else {}
+
+def running_job_count() -> int:
+    """Jobs running on this host, in any process (a render group's jobs each count)."""
+    host = socket.gethostname() + ":"
+    return _db().execute(
+        "SELECT COUNT(*) FROM jobs JOIN tasks ON tasks.id = jobs.task WHERE jobs.status = 'running' "
+        "AND tasks.state = 'running' AND substr(tasks.lease_owner, 1, ?) = ?", (len(host), host)).fetchone()[0]
+
+def running_task_count() -> int:
+    """Render tasks running on this host, in any process: each is one encode (a group's jobs
+    share theirs), so this is what its CPUs are divided among."""
+    host = socket.gethostname() + ":"
+    return _db().execute(
+        "SELECT COUNT(DISTINCT tasks.id) FROM jobs JOIN tasks ON tasks.id = jobs.task WHERE jobs.status = 'running' "
+        "AND tasks.state = 'running' AND substr(tasks.lease_owner, 1, ?) = ?", (len(host), host)).fetchone()[0]
+
+def prune_jobs(now: float):
+    """Forget finished jobs once their outputs have aged out, with the uploads of drafts never approved."""
+    with _db_tx() as db:
+        old = [json.loads(d) for (d,) in db.execute("SELECT data FROM jobs WHERE finished < ?", (now - TTL_SECONDS,))]
+        db.execute("DELETE FROM jobs WHERE finished < ?", (now - TTL_SECONDS,))
+        db.execute("DELETE FROM tasks WHERE state = 'finished' AND NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.task = tasks.id)")
+    for job in old:
+        if job["tmp_dir"]:
+            shutil.rmtree(job["tmp_dir"], ignore_errors=True)
+
+def sweep_spool(now: float):
+    """Remove upload dirs no job refers to (a request that died mid-upload) after a day."""
+    live = {d for (d,) in _db().execute("SELECT json_extract(data, '$.tmp_dir') FROM jobs") if d}
+    for d in SPOOL_DIR.iterdir():
+        try:
+            if str(d) not in live and now - d.stat().st_mtime > 86400:
+                shutil.rmtree(d, ignore_errors=True)
+        except FileNotFoundError:
             pass
-        time.sleep(CLEAN_INTERVAL)
 
-threading.Thread(target=cleanup_outputs, daemon=True).start()
+def job_view(job: dict) -> dict:
+    """
+    Public (JSON) view of a job, with links once it's done: an HLS ladder previews as its
+    master playlist and downloads as a ZIP of the whole directory.
+    """
+    view = {k: job[k] for k in ("id", "status", "design", "output", "error", "created", "started", "finished",
+                                  "timings", "cached", "progress", "eta", "fps", "speed", "media_duration",
+                                  "draft", "approved")}
+    view["format"] = job.get("format", "mp4")
+    done = job["status"] == "done"
+    hls = view["format"] == "hls" and not job["draft"]   # a draft's own output is a frame or an MP4
+    view["download"] = (url_for("jobs_bundle", ids=job["id"]) if hls else url_for("download", filename=job["output"])) if done else None
+    view["preview"] = url_for("preview", filename=f"{job['output']}/{HLS_MASTER}" if hls else job["output"]) if done else None
+    view["approve"] = url_for("approve", draft_id=job["id"]) if done and job["draft"] else None
+    return view
+
+# -------------------- Drafts --------------------
+# A draft is a job that renders a frame or a short low-res clip (compose_draft) on its own
+# own worker threads, cached like renders under draft_cache_key. It keeps its source (an upload's
+# temp dir) until it's approved, which queues the full render and hands the upload over,
+# or until prune_jobs forgets it.
+def submit_draft_job(source: str, text: str, design: str, kind: str, tmp_dir: str = "", client: str = "",
+                     duration: float | None = None, output_format: str = "mp4", timings: dict | None = None) -> str:
+    # cost and format are the full render's, admitted (and carried over) on approval
+    job = _new_job(source, text, design, tmp_dir, draft=kind, client=client, output_format=output_format,
+                   cost=predict_cost(duration, design, output_format), timings=timings)
+    with _db_tx() as db:
+        _insert_task(db, "draft", [job])
+    _work_ready["draft"].set()
+    return job["id"]
+
+def _run_draft_job(job_id: str):
+    job = get_job(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        return
+    _update_job(job_id, status="running", started=time.time())
+    timings: dict[str, float] = dict(job["timings"])
+    out_path = None
+    try:
+        local_video = fetch_source(job["source"], timings)
+        with stage(timings, "hash"):
+            key = draft_cache_key(local_video, job["text"], job["design"], job["draft"], LOGO_PATH)
+        with render_key_lock(key):
+            cached = render_cache_get(key)
+            if not cached:
+                with stage(timings, "caption"):
+                    caption = render_caption_image(job["text"], **CAPTION_STYLE)
+                out_path = reserve_output_path(job["text"], DRAFT_KINDS[job["draft"]])
+                output_acquire(out_path.name)
+                compose_draft(local_video, caption, job["design"], job["draft"], out_path, LOGO_PATH, timings)
+                output_register(out_path.name)
+                render_cache_put(key, out_path.name)
+        _update_job(job_id, status="done", output=cached or out_path.name, cached=bool(cached),
+                    finished=time.time(), timings=dict(timings))
+        log_render_job(get_job(job_id), "cached" if cached else "done")
+    except Exception as e:
+        app.logger.exception("draft %s failed", job_id)
+        if out_path is not None:
+            out_path.unlink(missing_ok=True)
+            output_forget(out_path.name)
+        if job["tmp_dir"]:   # nothing left to approve
+            shutil.rmtree(job["tmp_dir"], ignore_errors=True)
+        _update_job(job_id, status="failed", tmp_dir="", error=str(e) or e.__class__.__name__,
+                    finished=time.time(), timings=dict(timings))
+        log_render_job(get_job(job_id), "failed", failed_stage=next(reversed(timings), "start"))
+    finally:
+        if out_path is not None:
+            output_release(out_path.name)
+
+def approve_draft(draft_id: str) -> str:
+    """
+    Queue the full render of a finished draft and return its job id; approving again returns
+    the same job. Raises KeyError for an unknown draft, ValueError if it isn't done.
+    """
+    with _db_tx() as db:   # one transaction, so concurrent approvals queue a single render
+        draft = get_job(draft_id)
+        if draft is None or not draft["draft"]:
+            raise KeyError(draft_id)
+        if draft["approved"]:
+            return draft["approved"]
+        if draft["status"] != "done":
+            raise ValueError(f"draft is {draft['status']}")
+        job = _new_job(draft["source"], draft["text"], draft["design"], draft["tmp_dir"],
+                       client=draft.get("client", ""), cost=draft.get("cost", 0.0),
+                       output_format=draft.get("format", "mp4"))
+        _insert_task(db, "render", [job])
+        _patch_job(db, draft_id, {"approved": job["id"], "tmp_dir": ""})
+    _work_ready["render"].set()
+    return job["id"]
+
+# -------- workers --------
+def _worker_loop(kind: str):
+    ready = _work_ready[kind]
+    run = _run_render_group if kind == "render" else (lambda ids: _run_draft_job(ids[0]))
+    while True:
+        ready.clear()
+        try:
+            task = _claim_task(kind)
+        except sqlite3.Error:
+            app.logger.exception("claiming a %s task failed", kind)
+            task = None
+        if task is None:
+            ready.wait(JOB_POLL_INTERVAL)
+            continue
+        try:
+            run(task["job_ids"])
+        except Exception:
+            app.logger.exception("%s task %s failed", kind, task["id"])
+        finally:
+            _finish_task(task["id"])
+
+def start_workers():
+    """This process's render and draft worker threads and its lease heartbeat (once per process)."""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    _workers_pid = os.getpid()
+    for kind, n in (("render", RENDER_WORKERS), ("draft", DRAFT_WORKERS)):
+        for i in range(n):
+            threading.Thread(target=_worker_loop, args=(kind,), name=f"{kind}-{i}", daemon=True).start()
+    threading.Thread(target=_heartbeat, name="lease-heartbeat", daemon=True).start()
+
+# -------------------- Batches --------------------
+# A manifest of {source, caption, design} items becomes one job per item. Each distinct
+# source is fetched, probed and hashed once (prefetch_source is per source); items on the
+# same source render together in variant groups (one decode, see compose_variants), and
+# groups are queued round-robin across sources so workers aren't all parked on one download.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+VARIANT_GROUP_MAX = int(os.environ.get("VARIANT_GROUP_MAX", "4"))   # outputs per ffmpeg run
+BATCH_MAX_BYTES = 4 << 20
+
+def parse_manifest(body: str) -> list:
+    """Items from a JSON array, a {"items": [...]} object, or JSON Lines."""
+    try:
+        doc = json.loads(body)
+    except ValueError:
+        try:
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError as e:
+            raise ValueError(f"manifest is neither JSON nor JSON Lines: {e}") from None
+    if isinstance(doc, dict):
+        doc = doc["items"] if isinstance(doc.get("items"), list) else [doc]
+    if not isinstance(doc, list):
+        raise ValueError("manifest must be a list of items")
+    return doc
+
+def batch_item(raw, i: int, allow_local: bool = False, base_dir: Path | None = None) -> dict:
+    """Validate one manifest item; raises ValueError naming the item."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"item {i}: expected an object")
+    source = str(raw.get("source") or raw.get("link") or "").strip()
+    text = raw.get("caption", raw.get("text", ""))
+    design = str(raw.get("design") or "full").lower()
+    if not source:
+        raise ValueError(f"item {i}: missing source")
+    if not is_url(source):
+        if not allow_local:
+            raise ValueError(f"item {i}: source must be an http(s) link")
+        source = str((base_dir or Path.cwd()) / source)
+        if not os.path.isfile(source):
+            raise ValueError(f"item {i}: no such file {source}")
+    if not isinstance(text, str):
+        raise ValueError(f"item {i}: caption must be a string")
+    if design not in ("full", "mid"):
+        raise ValueError(f"item {i}: design must be full or mid")
+    output_format = str(raw.get("format") or "mp4").lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"item {i}: format must be one of {', '.join(OUTPUT_FORMATS)}")
+    return {"source": source, "text": text.strip(), "design": design, "format": output_format, "ref": raw.get("id")}
+
+def submit_batch(items: list[dict], client: str = "") -> str:
+    """Queue validated items (see batch_item); returns the batch id."""
+    by_source: dict[tuple[str, str], list[int]] = {}   # (source, format): a group renders one format
+    for i, it in enumerate(items):
+        by_source.setdefault((it["source"], it["format"]), []).append(i)
+    for source in {source for source, _ in by_source}:
+        prefetch_source(source)
+    # items on one source go in groups of up to VARIANT_GROUP_MAX (one decode each)
+    queues = [[idx[k:k + VARIANT_GROUP_MAX] for k in range(0, len(idx), VARIANT_GROUP_MAX)]
+              for idx in by_source.values()]
+    order = []
+    while queues:
+        order += [q.pop(0) for q in queues]
+        queues = [q for q in queues if q]
+
+    job_ids = [""] * len(items)
+    for group in order:
+        first = items[group[0]]
+        ids = submit_render_group(first["source"], [(items[i]["text"], items[i]["design"]) for i in group],
+                                  client=client, output_format=first["format"])
+        for i, job_id in zip(group, ids):
+            job_ids[i] = job_id
+    batch = {"id": os.urandom(8).hex(), "jobs": job_ids, "refs": [it["ref"] for it in items],
+             "created": time.time()}
+    with _db_tx() as db:
+        db.execute("INSERT INTO batches (id, created, data) VALUES (?, ?, ?)",
+                   (batch["id"], batch["created"], json.dumps(batch)))
+    return batch["id"]
+
+def get_batch(batch_id: str) -> dict | None:
+    row = _db().execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def iter_batch_results(batch_id: str):
+    """Yield (item index, job) for each item of a batch, in the order they finish (in any process)."""
+    batch = get_batch(batch_id)
+    pending = dict(enumerate(batch["jobs"]))
+    while pending:
+        jobs = get_jobs(list(pending.values()))
+        finished = [i for i, job_id in pending.items()
+                    if jobs.get(job_id, {"status": "failed"})["status"] in ("done", "failed")]
+        if not finished:
+            with _jobs_finished:
+                _jobs_finished.wait(JOB_POLL_INTERVAL)
+            continue
+        for i in finished:
+            job_id = pending.pop(i)
+            yield i, jobs.get(job_id) or {"id": job_id, "status": "failed", "error": "expired"}
+
+def batch_cli(argv: list[str]) -> int:
+    """python app.py batch manifest.jsonl: render a manifest locally, one JSON line per item."""
+    ap = argparse.ArgumentParser(prog="app.py batch", description="Render a manifest of shorts.")
+    ap.add_argument("manifest", help="JSON / JSON Lines file of {source, caption, design, format?, id?} items; - for stdin")
+    args = ap.parse_args(argv)
+    if args.manifest == "-":
+        body, base = sys.stdin.read(), Path.cwd()
+    else:
+        body, base = Path(args.manifest).read_text(), Path(args.manifest).resolve().parent
+    try:
+        items = [batch_item(it, i, allow_local=True, base_dir=base) for i, it in enumerate(parse_manifest(body))]
+    except ValueError as e:
+        ap.error(str(e))
+    start_background()
+    batch_id = submit_batch(items)
+    refs, failed = get_batch(batch_id)["refs"], 0
+    for i, job in iter_batch_results(batch_id):
+        failed += job["status"] != "done"
+        print(json.dumps({"item": i, "ref": refs[i], "status": job["status"], "error": job.get("error"),
+                          "output": str(OUTPUTS_DIR / job["output"]) if job.get("output") else None,
+                          "cached": job.get("cached"), "timings": job.get("timings")}), flush=True)
+    print(f"{len(items) - failed} done, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+def prune_batches():
+    """Forget batches none of whose jobs are left."""
+    with _db_tx() as db:
+        db.execute("DELETE FROM batches WHERE NOT EXISTS (SELECT 1 FROM json_each(batches.data, '$.jobs') AS j "
+                   "JOIN jobs ON jobs.id = j.value)")
+
+# -------------------- Admission control --------------------
+# Work is admitted against the shared job store before anything is queued: at most
+# CLIENT_MAX_JOBS unfinished jobs per client and QUEUE_MAX_JOBS overall, and no more than
+# QUEUE_MAX_SECONDS of predicted render time queued across RENDER_SLOTS. A job's cost is
+# predicted when it's queued, from its source's duration and the encode speed of recent
+# jobs of its design (the jobs table holds the last TTL_SECONDS of them), and stored on
+# the job, so the backlog is one query. Refusals are 429s whose Retry-After is the
+# predicted time for enough of the backlog to drain. Each process also caps the uploads
+# one client streams at once (CLIENT_MAX_UPLOADS), since each holds a request thread.
+CLIENT_MAX_JOBS = int(os.environ.get("CLIENT_MAX_JOBS", "100"))
+CLIENT_MAX_UPLOADS = int(os.environ.get("CLIENT_MAX_UPLOADS", "2"))
+QUEUE_MAX_JOBS = int(os.environ.get("QUEUE_MAX_JOBS", "1000"))
+QUEUE_MAX_SECONDS = float(os.environ.get("QUEUE_MAX_SECONDS", "1800"))   # wait ahead of new work, predicted
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "0")) or RENDER_WORKERS * int(os.environ.get("WEB_CONCURRENCY", "1"))
+FORM_MAX_ITEMS = int(os.environ.get("FORM_MAX_ITEMS", "20"))     # cards per /render or /drafts post
+FORM_MAX_BYTES = int(os.environ.get("FORM_MAX_BYTES", str(4 << 30)))   # a whole /render or /drafts post, 4 GiB
+COST_DEFAULT_SPEED = float(os.environ.get("COST_DEFAULT_SPEED", "1"))    # media s per render s, before any history
+COST_LINK_SECONDS = float(os.environ.get("COST_LINK_SECONDS", "60"))     # assumed length of a link not fetched yet
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "1"))   # proxies that append to X-Forwarded-For (Railway's edge: 1)
+RETRY_AFTER_MAX = 3600
+_uploads_lock = threading.Lock()
+_uploads: dict[str, int] = {}
+_speeds = {"t": 0.0, "by_design": {}}
+
+def client_id() -> str:
+    """The requesting client: the address the outermost of PROXY_HOPS proxies saw."""
+    route = request.access_route
+    return route[-PROXY_HOPS] if PROXY_HOPS and len(route) >= PROXY_HOPS else request.remote_addr or ""
+
+def render_seconds_per_media_second() -> dict[str, float]:
+    """
+    Per design ("<design>/hls" for HLS ladders), from the recent finished renders that
+    encoded (cached ones didn't); refreshed every 30s.
+    """
+    if time.time() - _speeds["t"] > 30:
+        rows = _db().execute(
+            "SELECT json_extract(data, '$.design') || IFNULL('/' || NULLIF(json_extract(data, '$.format'), 'mp4'), ''), "
+            "TOTAL(json_extract(data, '$.media_duration') / json_extract(data, '$.speed')), "
+            "TOTAL(json_extract(data, '$.media_duration')) FROM jobs WHERE status = 'done' "
+            "AND json_extract(data, '$.draft') IS NULL AND json_extract(data, '$.speed') > 0 GROUP BY 1")
+        _speeds.update(t=time.time(), by_design={design: wall / media for design, wall, media in rows if media})
+    return _speeds["by_design"]
+
+def predict_cost(duration: float | None, design: str, output_format: str = "mp4") -> float:
+    """Render seconds (of one render slot) a job on a `duration`-second source is expected to take."""
+    rates = render_seconds_per_media_second()
+    rate = rates.get(design, 1 / COST_DEFAULT_SPEED)
+    if output_format == "hls":
+        # until one has been timed: the MP4 rate scaled by the ladder's pixels over one 1080p encode
+        rate = rates.get(f"{design}/hls", rate * sum(w * h for w, h, _ in (HLS_LADDER[r] for r in HLS_RUNGS)) / (1080 * 1920))
+    return round((duration or COST_LINK_SECONDS) * rate, 1)
+
+def queue_load(client: str) -> tuple[int, float, int]:
+    """(unfinished jobs, predicted render seconds left on them, unfinished jobs of `client`)."""
+    return _db().execute(
+        "SELECT COUNT(*), TOTAL(CASE WHEN json_extract(data, '$.draft') IS NULL THEN json_extract(data, '$.cost') "
+        "* (1 - IFNULL(json_extract(data, '$.progress'), 0)) END), TOTAL(json_extract(data, '$.client') = ?) "
+        "FROM jobs WHERE status IN ('queued', 'running')", (client,)).fetchone()
+
+def admit(client: str, jobs: int, cost: float) -> tuple[str, int] | None:
+    """
+    None if `client` may queue `jobs` more jobs predicted to take `cost` render seconds,
+    else (reason, seconds to wait before trying again).
+    """
+    n, backlog, mine = queue_load(client)
+    mine = int(mine)
+    per_job = backlog / n if n else predict_cost(None, "full")
+
+    def wait(seconds: float) -> int:
+        return int(min(RETRY_AFTER_MAX, max(1, math.ceil(seconds))))
+
+    refusal = None
+    if mine + jobs > CLIENT_MAX_JOBS:
+        refusal = ("client", f"{mine} jobs of yours are unfinished; the limit is {CLIENT_MAX_JOBS}",
+                   wait((mine + jobs - CLIENT_MAX_JOBS) * per_job / RENDER_SLOTS))
+    elif n + jobs > QUEUE_MAX_JOBS:
+        refusal = ("queue", f"{n} jobs are queued; the limit is {QUEUE_MAX_JOBS}",
+                   wait((n + jobs - QUEUE_MAX_JOBS) * per_job / RENDER_SLOTS))
+    elif backlog and (backlog + cost) / RENDER_SLOTS > QUEUE_MAX_SECONDS:
+        refusal = ("backlog", f"{backlog / RENDER_SLOTS:.0f}s of predicted render time is queued",
+                   wait((backlog + cost) / RENDER_SLOTS - QUEUE_MAX_SECONDS))
+    if refusal is None:
+        return None
+    metric_inc("admission_refusals_total", reason=refusal[0])
+    return refusal[1:]
+
+@contextmanager
+def upload_slot(client: str):
+    """Hold one of `client`'s CLIENT_MAX_UPLOADS concurrent uploads in this process; yields False if none is free."""
+    with _uploads_lock:
+        free = _uploads.get(client, 0) < CLIENT_MAX_UPLOADS
+        if free:
+            _uploads[client] = _uploads.get(client, 0) + 1
+    if not free:
+        metric_inc("admission_refusals_total", reason="uploads")
+    try:
+        yield free
+    finally:
+        if free:
+            with _uploads_lock:
+                _uploads[client] -= 1
+                if not _uploads[client]:
+                    del _uploads[client]
+
+def too_busy(reason: str, retry_after: int):
+    resp = jsonify(error=f"busy: {reason}", retry_after=retry_after)
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+# -------------------- Startup --------------------
+# Importing this module starts nothing. warm_up() pays the first render's one-off costs up
+# front: the ffmpeg/ffprobe binaries (and a check of ffmpeg's encoders), the caption fonts
+# and their coverage table, the shaping and wrapping caches, the logo and the FULL base
+# plate. Under gunicorn it runs once in the master before the fork (preload_app, see
+# gunicorn.conf.py), so every worker inherits it. start_background() then starts a
+# process's threads (render/draft workers unless JOB_WORKERS=0, lease heartbeat, cleanup)
+# once per process, after the fork: from gunicorn's post_worker_init hook, from
+# `python app.py ...`, or on the first request under any other server.
+WARM_UP = os.environ.get("WARM_UP", "1") != "0"
+FFMPEG_REQUIRED_ENCODERS = ("libx264", "aac")
+_background_pid = 0
+
+def check_ffmpeg() -> set[str]:
+    """ffmpeg's encoder names; raises RuntimeError if one the renders need is missing, or ffprobe is."""
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, check=True).stdout
+    encoders = set(re.findall(r"^ [VAS][A-Z.]{5} (\S+)", out, re.M))
+    missing = [e for e in FFMPEG_REQUIRED_ENCODERS if e not in encoders]
+    if missing:
+        raise RuntimeError(f"ffmpeg lacks encoder(s) {', '.join(missing)}")
+    subprocess.run(["ffprobe", "-version"], capture_output=True, check=True)
+    return encoders
+
+def _warn_shaping():
+    """Say, once at startup, which scripts won't be shaped without raqm."""
+    if not HAS_RAQM:
+        app.logger.warning("Pillow has no raqm (is libfribidi installed?): Devanagari captions render unshaped, "
+                           "Arabic %s", "via arabic_reshaper" if arabic_reshaper else "unjoined and left to right")
+
+def warm_up() -> dict[str, float]:
+    """Load everything a first render would; returns the seconds each step took."""
+    timings: dict[str, float] = {}
+    _warn_shaping()
+    with stage(timings, "ffmpeg"):
+        check_ffmpeg()
+    with stage(timings, "caption"):
+        caption = render_caption_image("EduTap Shorts: warming up the caption fonts", **CAPTION_STYLE)
+    with stage(timings, "logo"):
+        file_digest(LOGO_PATH)
+        full_plate(LOGO_PATH, layout_full(caption.size, LOGO_PATH))
+        scaled_logo(LOGO_PATH)
+    app.logger.info(json.dumps({"event": "warm_up", "stages": {k: round(v, 3) for k, v in timings.items()}}))
+    return timings
+
+def start_background():
+    """This process's worker, heartbeat and cleanup threads (once per process)."""
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    _background_pid = os.getpid()
+    if JOB_WORKERS:
+        start_workers()
+    threading.Thread(target=cleanup_outputs, name="cleanup", daemon=True).start()
+    if METRICS:
+        threading.Thread(target=_metrics_flusher, name="metrics", daemon=True).start()
+
+@app.before_request
+def _start_background():
+    start_background()   # a no-op after the first call (gunicorn has already called it)
 
 # -------------------- UI --------------------
 HTML = """
@@ -381,10 +2749,13 @@ textarea{height:140px;resize:vertical}
 .spinner{width:64px;height:64px;border:6px solid #fff;border-top-color: {{ accent }};border-radius:50%;animation:spin 1s linear infinite}
 @keyframes spin{to{transform:rotate(360deg)}}
 #overlay p{color:#fff;margin-top:12px;text-align:center;font-weight:700}
+.job progress{width:160px;height:8px;vertical-align:middle;margin:0 8px;accent-color: {{ accent }}}
+.job .pct{color:var(--mut);font-variant-numeric:tabular-nums}
+.job button{margin-left:10px;padding:4px 10px;border-radius:8px;border:1px solid #1e3347;background:#122232;color:#cfe8f2;cursor:pointer}
 </style>
 
 <div id="overlay"><div style="display:flex;flex-direction:column;align-items:center">
-  <div class="spinner"></div><p>Rendering... please wait</p>
+  <div class="spinner"></div><p>Uploading... please wait</p>
 </div></div>
 
 <div class="wrap">
@@ -403,6 +2774,7 @@ textarea{height:140px;resize:vertical}
         <div class="controls">
           <label><input type="radio" name="design" value="full" {% if design=='full' %}checked{% endif %}> Full</label>
           <label><input type="radio" name="design" value="mid"  {% if design=='mid' %}checked{% endif %}> Mid</label>
+          <label title="A 1080p/720p/480p ladder for adaptive-bitrate players, instead of one MP4"><input type="checkbox" name="format" value="hls"> HLS</label>
           <button type="button" class="btn subtle" onclick="addItem()">+ Add Video</button>
         </div>
 
@@ -435,15 +2807,24 @@ textarea{height:140px;resize:vertical}
         <div class="row" style="margin-top:14px">
           <button class="btn" id="renderBtn" type="submit">Render</button>
         </div>
+        <div class="controls">
+          <small>Check the layout first:</small>
+          <button class="btn subtle" type="submit" formaction="{{ url_for('drafts', kind='still') }}">Preview frame</button>
+          <button class="btn subtle" type="submit" formaction="{{ url_for('drafts', kind='clip') }}">Preview clip</button>
+        </div>
       </form>
     </div>
   </div>
 
-  {% if last_files %}
-    <div style="max-width:1200px;margin:16px auto 30px">
-      {% for name in last_files %}
-        <div style="margin:8px 0">✅ <a style="color:#9ef" href="{{ url_for('download', filename=name) }}">{{ name }}</a></div>
+  {% if jobs %}
+    <div id="jobs" style="max-width:1200px;margin:16px auto 30px">
+      {% for job in jobs %}
+        <div class="job" data-id="{{ job.id }}" style="margin:8px 0">
+          <span class="st">⏳ queued</span><progress max="1" hidden></progress><span class="pct"></span>
+          — {{ job.text[:80] or 'video' }}
+        </div>
       {% endfor %}
+      {% if jobs|length > 1 %}<a id="bundle" hidden style="color:#9ef;display:inline-block;margin-top:8px">⬇ Download all (.zip)</a>{% endif %}
       <div style="color:#8aa0b6;margin-top:10px">Files auto-delete after about {{ ttl }} seconds.</div>
     </div>
   {% endif %}
@@ -451,9 +2832,80 @@ textarea{height:140px;resize:vertical}
 
 <script>
   const overlay = document.getElementById('overlay');
-  const btn = document.getElementById('renderBtn');
   const form = document.getElementById('renderForm');
-  form.addEventListener('submit', () => { btn.disabled = true; overlay.style.display = 'flex'; });
+  form.addEventListener('submit', () => { form.querySelectorAll('[type=submit]').forEach(b => b.disabled = true); overlay.style.display = 'flex'; });
+
+  // follow queued jobs until each one is done or failed: one event stream for the page
+  // (the server ends each response after a while and EventSource reconnects), falling
+  // back to polling each job where EventSource isn't available or keeps failing
+  const ICON = {queued: '⏳', running: '⚙️', done: '✅', failed: '❌'};
+  const FINAL = ['done', 'failed'];
+  function showBundle(){
+    // once every row is finished, one link fetches all their outputs as a ZIP
+    const link = document.getElementById('bundle');
+    if(!link) return;
+    link.hidden = !rows.every(r => FINAL.includes(r.dataset.status)) || !rows.some(r => r.dataset.status === 'done');
+    link.href = '/jobs/bundle?ids=' + rows.map(r => r.dataset.id).join(',');
+  }
+  function showJob(row, job){
+    row.dataset.status = job.status; showBundle();
+    const st = row.querySelector('.st'), bar = row.querySelector('progress'), pct = row.querySelector('.pct');
+    bar.hidden = job.status !== 'running' || job.progress == null;
+    if(!bar.hidden){
+      bar.value = job.progress;
+      pct.textContent = Math.floor(job.progress * 100) + '%' +
+        (job.eta != null ? ' · ' + Math.ceil(job.eta) + 's left' : '') +
+        (job.speed ? ' · ' + job.speed.toFixed(1) + 'x' : '');
+    }else{
+      pct.textContent = '';
+    }
+    if(job.status === 'done'){
+      st.innerHTML = ICON.done + ' <a style="color:#9ef"></a>';
+      const a = st.querySelector('a'); a.href = job.download; const hls = job.format === 'hls' && !job.draft;
+      a.textContent = job.output + (hls ? ' (.zip)' : '');
+      const p = document.createElement('a'); p.href = job.preview; p.target = '_blank';
+      p.textContent = job.draft === 'still' ? '🖼 view frame' : hls ? '▶ master playlist' : '▶ preview'; p.style = 'color:#9ef;margin-left:10px'; st.appendChild(p);
+      if(job.speed) pct.textContent = ' ' + job.speed.toFixed(1) + 'x realtime';
+      if(job.approve && !job.approved){
+        // a draft: approving queues the full render, which this row then follows
+        const b = document.createElement('button'); b.type = 'button'; b.textContent = 'Approve & render';
+        b.onclick = () => {
+          b.disabled = true;
+          fetch(job.approve, {method: 'POST'}).then(r => r.json().then(full => {
+            if(!r.ok){ b.disabled = false; b.title = full.error || r.statusText; return; }   // e.g. 429 busy
+            row.dataset.id = full.id; showJob(row, full); pollJob(row);
+          })).catch(() => { b.disabled = false; });
+        };
+        st.appendChild(b);
+      }
+      return;
+    }
+    st.textContent = ICON[job.status] + ' ' + job.status + (job.error ? ': ' + job.error : '');
+  }
+  function pollJob(row){
+    fetch('/jobs/' + row.dataset.id).then(r => r.json()).then(job => {
+      showJob(row, job);
+      if(!FINAL.includes(job.status)) setTimeout(() => pollJob(row), 2000);
+    }).catch(() => setTimeout(() => pollJob(row), 5000));
+  }
+  const rows = [...document.querySelectorAll('.job')];
+  if(rows.length && window.EventSource){
+    const byId = Object.fromEntries(rows.map(r => [r.dataset.id, r]));
+    const es = new EventSource('/jobs/events?ids=' + rows.map(r => r.dataset.id).join(','));
+    es.addEventListener('job', e => {
+      const job = JSON.parse(e.data), row = byId[job.id];
+      if(row.dataset.id === job.id) showJob(row, job);   // an approved draft's row follows its render instead
+    });
+    es.addEventListener('end', () => es.close());
+    let failures = 0;
+    es.onopen = () => { failures = 0; };
+    es.onerror = () => {
+      // an error also fires on each routine reconnect; give up only if it can't get back
+      if(es.readyState === EventSource.CLOSED || ++failures > 3){ es.close(); rows.forEach(pollJob); }
+    };
+  }else{
+    rows.forEach(pollJob);
+  }
 
   function toggleMode(radio){
     const card = radio.closest('.card');
@@ -514,94 +2966,679 @@ textarea{height:140px;resize:vertical}
 </script>
 """
 
-# -------------------- Flask routes --------------------
-@app.get("/")
-def index():
-    return render_template_string(HTML, last_files=None, design="full", ttl=TTL_SECONDS, accent=ACCENT)
+# -------------------- Streaming form uploads --------------------
+# /render parses its multipart body straight off the socket: each file part is written to
+# its job's temp dir in bounded chunks (hashed on the way for the render cache), and each
+# item is queued as soon as its fields are in, while later files are still uploading.
+UPLOAD_CHUNK = 256 << 10
+UPLOAD_EXTS = (".mp4", ".mov", ".m4v", ".qt")
+_ITEM_FIELD_RE = re.compile(r"(mode|file|link|text)_(\d+)$")
+_FORM_FIELDS = ("design", "format", "total_items")   # must precede the items (browsers send them first)
 
-def _save_upload(file_storage, tmp_root) -> str:
-    if not file_storage or file_storage.filename == "":
-        return ""
-    fn = secure_filename(file_storage.filename)
-    ext = Path(fn).suffix.lower()
-    if ext not in [".mp4",".mov",".m4v",".qt"]:
-        ext = ".mp4"
-    out = Path(tmp_root) / ("input" + ext)
-    file_storage.save(out)
-    return str(out)
-
-@app.post("/render")
-def render():
-    design = (request.form.get("design","full") or "full").lower()
+def stream_render_items(on_item, on_over=None) -> str:
+    """
+    Parse the /render form, calling on_item(design, item) once per complete item (up to
+    FORM_MAX_ITEMS), where item = {i, mode, text, link, path, tmp, format}. `tmp` (the
+    upload's temp dir) is owned by the callee from then on. Items past FORM_MAX_ITEMS are
+    passed to on_over(item) instead, their uploads drained unwritten. Returns the chosen design.
+    Raises RequestEntityTooLarge, with the rest of the body unread, once an upload passes
+    SOURCE_MAX_BYTES or the post passes FORM_MAX_BYTES, and ValueError on a truncated or
+    malformed multipart body or a _FORM_FIELDS field sent after an item was passed on;
+    either way, items already passed on stay queued.
+    """
+    form = {"design": "full", "format": "mp4", "total_items": ""}
+    items: dict[int, dict] = {}
+    current = [None]
+
+    def item(i: int) -> dict:
+        return items.setdefault(i, {"i": i, "mode": "upload", "text": "", "link": "", "path": "",
+                                    "tmp": "", "seen": set(), "sent": False})
+
+    def ready(it: dict) -> bool:
+        # fields can arrive in any order (browsers send DOM order: mode, file, link, text)
+        return "text" in it["seen"] and (it["mode"] == "link" or "file" in it["seen"])
+
+    def flush(i: int):
+        it = items.get(i)
+        if it is None or it["sent"]:
+            return
+        it["sent"] = True
+        try:
+            n = max(1, int(form["total_items"]))
+        except ValueError:
+            n = None
+        if i >= FORM_MAX_ITEMS or (n is not None and i >= n):
+            if it["tmp"]:
+                shutil.rmtree(it["tmp"], ignore_errors=True)
+            if i >= FORM_MAX_ITEMS and on_over is not None:
+                on_over(it)
+            return
+        it["text"] = it["text"].strip(); it["link"] = it["link"].strip()
+        it["format"] = form["format"] if form["format"] in OUTPUT_FORMATS else "mp4"
+        on_item((form["design"] or "full").lower(), it)
+
+    def enter(i: int):
+        # moving on to another card: queue the previous one if it has everything it needs
+        prev = current[0]
+        if prev is not None and prev != i and ready(items[prev]):
+            flush(prev)
+        current[0] = i
+
+    def on_field(name: str, value: str):
+        m = _ITEM_FIELD_RE.match(name)
+        if not m:
+            if name in _FORM_FIELDS and any(it["sent"] for it in items.values()):
+                raise ValueError(f"{name} came after the items it applies to")
+            form[name] = value
+            return
+        i = int(m.group(2))
+        enter(i)
+        it = item(i)
+        it[m.group(1)] = value
+        it["seen"].add(m.group(1))
+        if ready(it):
+            flush(i)
+
+    def on_file_done(i: int):
+        it = item(i)
+        it["seen"].add("file")
+        if ready(it):
+            flush(i)
 
     try:
-        n = int(request.form.get("total_items","1"))
-    except Exception:
-        n = 1
-    n = max(1, n)
-
-    produced = []
-    temp_batch = tempfile.mkdtemp(prefix="batch_")
+        if request.mimetype == "multipart/form-data":
+            _stream_multipart(on_field, on_file_done, enter, item)
+        else:
+            for name, value in request.form.items(multi=True):
+                on_field(name, value)
+        for i in sorted(items):
+            flush(i)
+    except BaseException:
+        for it in items.values():
+            if not it["sent"] and it["tmp"]:
+                shutil.rmtree(it["tmp"], ignore_errors=True)
+        raise
+    return (form["design"] or "full").lower()
+
+def _stream_multipart(on_field, on_file_done, enter, item):
+    boundary = request.mimetype_params.get("boundary", "").encode()
+    if not boundary:
+        abort(400)
+    decoder = MultipartDecoder(boundary, max_form_memory_size=1 << 20)
+    stream = request.stream
+    name, idx, buf, out, digest, received = "", None, bytearray(), None, None, 0
     try:
-        for i in range(n):
-            mode = request.form.get(f"mode_{i}","upload")
-            text = request.form.get(f"text_{i}","").strip()
-            link = request.form.get(f"link_{i}","").strip()
-            file_storage = request.files.get(f"file_{i}")
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = stream.read(UPLOAD_CHUNK)
+                received += len(chunk)
+                if received > FORM_MAX_BYTES:   # a chunked post has no Content-Length to refuse up front
+                    raise RequestEntityTooLarge(f"the form is larger than {FORM_MAX_BYTES >> 20} MiB")
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, Field):
+                name, idx = event.name, None
+                buf.clear()
+            elif isinstance(event, File):
+                # file_<i> parts stream to disk; any other file part is drained and dropped
+                name, idx = event.name, -1
+                m = _ITEM_FIELD_RE.match(name)
+                if m and m.group(1) == "file":
+                    idx = int(m.group(2))
+                    enter(idx)
+                    if event.filename and idx < FORM_MAX_ITEMS:
+                        # uploads must outlive the request (and be readable by whichever
+                        # worker claims the job), so each job owns a dir in SPOOL_DIR
+                        it = item(idx)
+                        ext = Path(secure_filename(event.filename)).suffix.lower()
+                        it["tmp"] = tempfile.mkdtemp(prefix="job_", dir=SPOOL_DIR)
+                        it["path"] = str(Path(it["tmp"]) / ("input" + (ext if ext in UPLOAD_EXTS else ".mp4")))
+                        out, digest = open(it["path"], "wb"), hashlib.sha256()
+            elif isinstance(event, Data):
+                if out is not None:
+                    out.write(event.data)
+                    digest.update(event.data)
+                    if out.tell() > SOURCE_MAX_BYTES:   # stop here rather than read the rest of it
+                        raise RequestEntityTooLarge(f"video {idx + 1} is larger than {SOURCE_MAX_BYTES >> 20} MiB")
+                elif idx is None:
+                    buf += event.data
+                if not event.more_data:
+                    if out is not None:
+                        metric_inc("upload_bytes_total", out.tell())
+                        out.close()
+                        out = None
+                        remember_digest(item(idx)["path"], digest.hexdigest())
+                    if idx is None:
+                        on_field(name, buf.decode("utf-8", "replace"))
+                    elif idx >= 0:
+                        on_file_done(idx)
+            elif isinstance(event, Epilogue):
+                return
+    finally:
+        if out is not None:
+            out.close()
+
+# -------------------- Output serving --------------------
+# /download and /preview answer Range, If-Range, If-None-Match and If-Modified-Since
+# themselves. The body is the open file handed to the server's wsgi.file_wrapper, which
+# gunicorn sends with sendfile(2) from the file's current offset for Content-Length bytes,
+# so ranges are zero-copy too. With SENDFILE_MODE=x-accel (nginx) or x-sendfile
+# (Apache/lighttpd) the front proxy sends the file and the worker is released immediately.
+OUTPUT_TYPES = {".mp4": "video/mp4", ".png": "image/png", ".jpg": "image/jpeg",
+                ".m3u8": "application/vnd.apple.mpegurl", ".m4s": "video/iso.segment"}   # the last two: in .hls dirs
+
+class _HeldFile(io.FileIO):
+    """An output opened for serving; holds it (output_acquire) until closed."""
+    def __init__(self, path: Path, name: str):
+        self.name_ = name
+        output_acquire(name)   # before opening, so a sweeper can't remove it in between
+        try:
+            super().__init__(path, "rb")
+        except BaseException:
+            output_release(name)
+            raise
 
-            if mode == "link":
-                if not link:
-                    continue
-                local_video, tmpdir = download_video_to_temp(link)
-                tmp_cleanup = tmpdir
-            else:
-                local_video = _save_upload(file_storage, temp_batch)
-                if not local_video:
-                    continue
-                tmp_cleanup = ""
-
-            # Caption -> PNG (Pillow)
-            cap_png = OUTPUTS_DIR / f"caption_{os.urandom(6).hex()}.png"
-            render_caption_png_pillow(
-                text, cap_png,
-                max_width=1000, font_size=52, line_height=1.35,
-                pad_x=18, pad_y=10, radius=8
-            )
-
-            # Output filename (unique)
-            base_name = safe_filename_from_text(text)
-            candidate = OUTPUTS_DIR / base_name
-            if candidate.exists():
-                ts = time.strftime("%Y%m%d_%H%M%S")
-                candidate = OUTPUTS_DIR / f"{Path(base_name).stem}_{ts}.mp4"
-
-            # Compose (CPU only)
-            if design == "mid":
-                compose_mid(local_video, cap_png, candidate, LOGO_PATH)
-            else:
-                compose_full(local_video, cap_png, candidate, LOGO_PATH)
+    def close(self):
+        if not self.closed:
+            super().close()
+            output_release(self.name_)
+
+def _read_exactly(f, length: int, chunk: int = 1 << 20):
+    try:
+        while length > 0:
+            b = f.read(min(chunk, length))
+            if not b:
+                break
+            length -= len(b)
+            yield b
+    finally:
+        f.close()
+
+def _if_range_ok(etag: str, mtime: float) -> bool:
+    cond = request.if_range
+    if cond.etag:
+        return cond.etag == etag
+    if cond.date:
+        return int(mtime) <= cond.date.timestamp()
+    return True
+
+def serve_output(filename: str, inline: bool):
+    # an output is a file, or a file inside an HLS ladder's directory (<name>.hls/<rung>/...)
+    path = safe_join(str(OUTPUTS_DIR), filename)
+    name = filename.split("/", 1)[0]   # what retention tracks
+    suffix = Path(filename).suffix.lower()
+    if (path is None or filename.startswith(".") or suffix not in OUTPUT_TYPES or not os.path.isfile(path)
+            or (name != filename and not name.endswith(".hls"))):
+        abort(404)
+    st = os.stat(path)
+    size = st.st_size
+    etag = f"{st.st_ino:x}-{size:x}-{st.st_mtime_ns:x}"
+
+    resp = app.response_class(status=200, mimetype=OUTPUT_TYPES[suffix], direct_passthrough=True)
+    resp.set_etag(etag)
+    resp.last_modified = int(st.st_mtime)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = TTL_SECONDS
+    resp.accept_ranges = "bytes"
+    resp.headers["Content-Disposition"] = dump_options_header("inline" if inline else "attachment",
+                                                              {"filename": Path(filename).name})
+    if not is_resource_modified(request.environ, etag=etag, last_modified=resp.last_modified):
+        resp.status_code = 304
+        return resp
+
+    rng = request.range if _if_range_ok(etag, st.st_mtime) else None
+    first = rng.ranges[0][0] if rng else 0
+    # a fresh download counts toward keeping the output; seeks and previews only touch it
+    output_touch(name, download=first == 0 and not inline and request.method != "HEAD")
+
+    if SENDFILE_MODE == "x-accel":   # nginx applies Range to the internal location itself
+        resp.headers["X-Accel-Redirect"] = SENDFILE_PREFIX.rstrip("/") + "/" + quote(filename)
+        return resp
+    if SENDFILE_MODE == "x-sendfile":
+        resp.headers["X-Sendfile"] = path
+        return resp
+
+    start, length = 0, size
+    if rng is not None and len(rng.ranges) == 1:   # multi-range requests get the whole file
+        span = rng.range_for_length(size)
+        if span is None:
+            resp.status_code = 416
+            resp.content_range = ContentRange("bytes", None, None, size)
+            resp.content_length = 0
+            return resp
+        start, length = span[0], span[1] - span[0]
+        resp.status_code = 206
+        resp.content_range = ContentRange("bytes", span[0], span[1], size)
+
+    resp.content_length = length
+    if request.method == "HEAD":
+        return resp
+    try:
+        f = _HeldFile(Path(path), name)
+    except FileNotFoundError:   # evicted since the stat above
+        abort(404)
+    f.seek(start)
+    wrapper = request.environ.get("wsgi.file_wrapper")
+    if wrapper and (start + length == size or request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")):
+        resp.response = wrapper(f, 1 << 20)
+    else:
+        resp.response = _read_exactly(f, length)   # other servers' file wrappers read to EOF
+    return resp
+
+# -------- bundles: several outputs as one streamed ZIP --------
+# Entries are stored, not deflated (MP4 and JPEG are compressed already), so the archive's
+# length is known before a byte is sent and goes out as Content-Length. Each entry's
+# CRC-32 (which its local header needs) is read in a pass over the file just before it is
+# sent; that second read comes from the page cache. Memory stays at one 1 MiB chunk plus
+# a ~100-byte directory record per entry, and nothing is written to disk. Every file
+# (each file of an HLS ladder too) is opened and held (_HeldFile) before Content-Length is
+# computed, so retention can't delete one mid-stream; ZIP64 records are used only once an
+# archive outgrows 4 GiB or 65535 entries.
+ZIP_MAX32, ZIP_MAX16 = 0xFFFFFFFF, 0xFFFF
+ZIP_UTF8 = 0x800
+
+def _dos_datetime(mtime: float) -> tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800))   # DOS dates start in 1980
+    return (t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+            (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday)
+
+def _zip_local_header(name: bytes, crc: int, size: int, dos: tuple[int, int]) -> bytes:
+    big = size >= ZIP_MAX32
+    extra = struct.pack("<HHQQ", 1, 16, size, size) if big else b""
+    return struct.pack("<IHHHHHIIIHH", 0x04034B50, 45 if big else 20, ZIP_UTF8, 0, *dos, crc,
+                       ZIP_MAX32 if big else size, ZIP_MAX32 if big else size, len(name), len(extra)) + name + extra
+
+def _zip_central_header(name: bytes, crc: int, size: int, dos: tuple[int, int], offset: int) -> bytes:
+    big_size, big_offset = size >= ZIP_MAX32, offset >= ZIP_MAX32
+    fields = ([size, size] if big_size else []) + ([offset] if big_offset else [])
+    extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+    version = 45 if fields else 20
+    return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 3 << 8 | version, version, ZIP_UTF8, 0, *dos, crc,
+                       ZIP_MAX32 if big_size else size, ZIP_MAX32 if big_size else size,
+                       len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                       ZIP_MAX32 if big_offset else offset) + name + extra
+
+def _zip_end(count: int, cd_offset: int, cd_size: int) -> bytes:
+    out = b""
+    if count >= ZIP_MAX16 or cd_offset >= ZIP_MAX32 or cd_size >= ZIP_MAX32:
+        out += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 3 << 8 | 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        out += struct.pack("<IIQI", 0x07064B50, 0, cd_offset + cd_size, 1)
+    return out + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP_MAX16), min(count, ZIP_MAX16),
+                             min(cd_size, ZIP_MAX32), min(cd_offset, ZIP_MAX32), 0)
+
+def _zip_entries(files: list[tuple[str, _HeldFile]]) -> list[tuple[bytes, int, tuple[int, int]]]:
+    """(name, size, DOS time) per (arcname, file), in archive order."""
+    entries = []
+    for arcname, f in files:
+        st = os.fstat(f.fileno())
+        entries.append((arcname.encode(), st.st_size, _dos_datetime(st.st_mtime)))
+    return entries
+
+def zip_length(files: list[tuple[str, _HeldFile]]) -> int:
+    """Bytes zip_stream(files) will produce (headers don't depend on the CRCs)."""
+    offset, cd_size = 0, 0
+    for name, size, dos in _zip_entries(files):
+        cd_size += len(_zip_central_header(name, 0, size, dos, offset))
+        offset += len(_zip_local_header(name, 0, size, dos)) + size
+    return offset + cd_size + len(_zip_end(len(files), offset, cd_size))
+
+def _file_chunks(f, length: int, chunk: int):
+    while length > 0:
+        b = f.read(min(chunk, length))
+        if not b:
+            raise IOError(f"{f.name} shrank while being bundled")
+        length -= len(b)
+        yield b
+
+def zip_stream(files: list[tuple[str, _HeldFile]], chunk: int = 1 << 20):
+    """Yield a stored ZIP of `files`, closing each once sent (and the rest if the client goes away)."""
+    try:
+        central, offset = [], 0
+        for (_, f), (name, size, dos) in zip(files, _zip_entries(files)):
+            crc = 0
+            for b in _file_chunks(f, size, chunk):
+                crc = zlib.crc32(b, crc)
+            f.seek(0)
+            header = _zip_local_header(name, crc, size, dos)
+            yield header
+            yield from _file_chunks(f, size, chunk)
+            f.close()
+            central.append(_zip_central_header(name, crc, size, dos, offset))
+            offset += len(header) + size
+        directory = b"".join(central)
+        yield directory + _zip_end(len(central), offset, len(directory))
+    finally:
+        for _, f in files:
+            f.close()
+
+def _open_output_files(name: str) -> list[tuple[str, _HeldFile]]:
+    """(arcname, open file) for an output: the file, or every file of an HLS ladder's directory."""
+    path = OUTPUTS_DIR / name
+    if not path.is_dir():
+        return [(name, _HeldFile(path, name))]
+    files = []
+    try:
+        for p in sorted(p for p in path.rglob("*") if p.is_file()):
+            files.append((f"{name}/{p.relative_to(path).as_posix()}", _HeldFile(p, name)))
+    except BaseException:
+        for _, f in files:
+            f.close()
+        raise
+    return files
+
+def serve_bundle(jobs: list[dict], filename: str):
+    """
+    A ZIP of the finished outputs of `jobs` (409 while any is still rendering; gone ones are
+    left out). An HLS ladder goes in as its directory tree, <name>.hls/<rung>/...
+    """
+    pending = sum(j["status"] not in ("done", "failed") for j in jobs)
+    if pending:
+        return jsonify(error=f"{pending} job(s) still rendering"), 409
+    files = []
+    try:
+        for name in dict.fromkeys(j["output"] for j in jobs if j["status"] == "done" and j["output"]):
+            try:
+                files += _open_output_files(name)
+            except FileNotFoundError:
+                continue   # aged out
+            output_touch(name, download=True)
+        if not files:
+            abort(404)
+        resp = app.response_class(status=200, mimetype="application/zip", direct_passthrough=True)
+        resp.content_length = zip_length(files)
+    except BaseException:
+        for _, f in files:
+            f.close()
+        raise
+    resp.cache_control.private = True
+    resp.headers["Content-Disposition"] = dump_options_header("attachment", {"filename": filename})
+    if request.method == "HEAD":
+        for _, f in files:
+            f.close()
+        return resp
+    resp.response = zip_stream(files)
+    return resp
 
-            produced.append(candidate.name)
+# -------------------- Flask routes --------------------
+if METRICS:
+    @app.before_request
+    def _request_clock():
+        request.environ["edutap.t0"] = time.perf_counter()
+
+    @app.after_request
+    def _request_metrics(resp):
+        # streamed bodies (e.g. /jobs/events) are timed to the first byte only
+        seconds = time.perf_counter() - request.environ.get("edutap.t0", time.perf_counter())
+        endpoint = request.endpoint or "unmatched"
+        metric_observe("http_request_seconds", seconds, endpoint=endpoint, method=request.method)
+        if endpoint != "metrics":
+            app.logger.info(json.dumps({"event": "http", "method": request.method, "path": request.path,
+                                        "endpoint": endpoint, "status": resp.status_code,
+                                        "seconds": round(seconds, 4)}))
+        return resp
+
+@app.get("/metrics")
+def metrics():
+    if not METRICS:
+        abort(404)
+    return app.response_class(metrics_text(), mimetype="text/plain; version=0.0.4")
 
-            # cleanup
-            if tmp_cleanup and os.path.isdir(tmp_cleanup):
-                shutil.rmtree(tmp_cleanup, ignore_errors=True)
-            if cap_png.exists():
-                cap_png.unlink(missing_ok=True)
+@app.get("/")
+def index():
+    return render_template_string(HTML, jobs=None, design="full", ttl=TTL_SECONDS, accent=ACCENT)
 
-        if not produced:
+def _queue_form(submit, done_message: str, cached=None):
+    """
+    Stream the render form, queueing each item with submit(source, text, design, tmp_dir,
+    client=, duration=, output_format=, timings=). Uploads are probed against the source budget and every item is
+    admitted (see admit) as it arrives; refused items are reported, not queued. An item that
+    cached(source, text, design, output_format) answers needs no admission.
+    """
+    wants_json = request.accept_mimetypes.best == "application/json"
+    client = client_id()
+    if (request.content_length or 0) > FORM_MAX_BYTES:   # refused unread, so don't keep the connection
+        return jsonify(error=f"the form is larger than {FORM_MAX_BYTES >> 20} MiB"), 413, {"Connection": "close"}
+    busy = admit(client, 1, 0.0)
+    with upload_slot(client) as free:
+        if not free:
+            busy = (f"{CLIENT_MAX_UPLOADS} uploads of yours are in progress", 10)
+        if busy:   # refused unread, like the 413 above
+            if wants_json:
+                return too_busy(*busy), {"Connection": "close"}
+            flash(f"The server is busy ({busy[0]}). Try again in {busy[1]} s.")
+            return (render_template_string(HTML, jobs=None, design="full", ttl=TTL_SECONDS, accent=ACCENT),
+                    429, {"Retry-After": str(busy[1]), "Connection": "close"})
+        queued, refused = [], []
+
+        def on_item(design: str, item: dict):
+            duration, spent = None, {}
+            if item["mode"] == "link":
+                if item["tmp"]:
+                    shutil.rmtree(item["tmp"], ignore_errors=True)
+                source, tmp = item["link"], ""   # checked once fetched (see _prepare_source)
+                if source and not is_url(source):   # a server path would skip check_source
+                    refused.append({"item": item["i"], "error": "source must be an http(s) link", "status": 400})
+                    return
+            else:
+                source, tmp = item["path"], item["tmp"]
+                try:
+                    with stage(spent, "probe"):
+                        duration = media_duration(check_source(source)) if source else None
+                except ValueError as e:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    metric_inc("admission_refusals_total", reason="source")
+                    refused.append({"item": item["i"], "error": str(e), "status": 413})
+                    return
+            if not source:
+                return
+            hit = cached is not None and cached(source, item["text"], design, item["format"])
+            refusal = None if hit else admit(client, 1, predict_cost(duration, design, item["format"]))
+            if refusal:
+                if tmp:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                refused.append({"item": item["i"], "error": f"busy: {refusal[0]}", "status": 429,
+                                "retry_after": refusal[1]})
+                return
+            queued.append(submit(source, item["text"], design, tmp, client=client, duration=duration,
+                                 output_format=item["format"], timings=spent))
+
+        cut, cut_status = "", 413
+        try:
+            design = stream_render_items(on_item, lambda item: refused.append(
+                {"item": item["i"], "error": f"at most {FORM_MAX_ITEMS} items per form", "status": 413}))
+        except RequestEntityTooLarge as e:
+            design, cut = "full", e.description   # items queued before it stay queued
+        except ValueError as e:   # werkzeug's decoder on a truncated or malformed multipart body
+            design, cut, cut_status = "full", f"the upload was truncated or malformed ({e})", 400
+
+    status = 202 if queued else cut_status if cut else max((r["status"] for r in refused), default=400)
+    retry_after = max((r.get("retry_after", 0) for r in refused), default=0)
+    headers = {"Retry-After": str(retry_after)} if status == 429 else {}
+    if cut:
+        headers["Connection"] = "close"   # the rest of the body is left unread
+    if wants_json:
+        body = {"jobs": [job_view(get_job(j)) for j in queued], "refused": refused}
+        return jsonify({**body, "error": cut} if cut else body), status, headers
+
+    if cut:
+        flash(f"The form was cut short, so later videos were not queued: {cut}.")
+    for r in refused:
+        flash(f"Video {r['item'] + 1} was not queued: {r['error']}.")
+    if not queued:
+        if not refused and not cut:
             flash("Please add at least one valid item (upload a file or provide a link).")
-            return render_template_string(HTML, last_files=None, design=design, ttl=TTL_SECONDS, accent=ACCENT)
+        return render_template_string(HTML, jobs=None, design=design, ttl=TTL_SECONDS, accent=ACCENT), status, headers
 
-        flash("Render complete!")
-        return render_template_string(HTML, last_files=produced, design=design, ttl=TTL_SECONDS, accent=ACCENT)
-    finally:
-        shutil.rmtree(temp_batch, ignore_errors=True)
+    flash(done_message.format(n=len(queued)))
+    return render_template_string(HTML, jobs=[get_job(j) for j in queued], design=design, ttl=TTL_SECONDS, accent=ACCENT)
+
+@app.post("/render")
+def render():
+    return _queue_form(submit_render_job, "Queued {n} video(s). Download links appear below as they finish.",
+                       cached=render_cache_peek)
+
+@app.post("/drafts")
+def drafts():
+    """The /render form, but each item gets a draft (?kind=still|clip) to approve first."""
+    kind = request.args.get("kind", "still")
+    if kind not in DRAFT_KINDS:
+        abort(400)
+    return _queue_form(lambda source, text, design, tmp, **kw: submit_draft_job(source, text, design, kind, tmp, **kw),
+                       "Drafting {n} video(s). Approve each one below to queue its full render.")
+
+@app.post("/drafts/<draft_id>/approve")
+def approve(draft_id):
+    draft = get_job(draft_id)
+    busy = admit(client_id(), 1, draft.get("cost", 0.0)) if draft and not draft.get("approved") else None
+    if busy:
+        return too_busy(*busy)
+    try:
+        job_id = approve_draft(draft_id)
+    except KeyError:
+        abort(404)
+    except ValueError as e:
+        return jsonify(error=str(e)), 409
+    resp = jsonify(job_view(get_job(job_id)))
+    resp.status_code = 202
+    resp.headers["Location"] = url_for("job_status", job_id=job_id)
+    return resp
+
+@app.get("/jobs/events")
+def job_events():
+    """
+    Server-sent events for a set of jobs: one `job` event per change, `end` once all are
+    finished. A response lasts at most JOB_EVENTS_MAX_SECONDS, so it only borrows a server
+    thread; then it closes without `end`, and EventSource reconnects after the `retry:` delay
+    and gets each job's current state again.
+    """
+    ids = [i for i in request.args.get("ids", "").split(",") if i][:50]
+    if not ids:
+        abort(400)
+
+    def stream():
+        last = {}
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        yield "retry: 2000\n\n"
+        while True:
+            pending = False
+            for job_id in ids:
+                job = get_job(job_id)
+                if job is None:
+                    continue
+                view = job_view(job)
+                body = json.dumps(view)
+                if last.get(job_id) != body:
+                    last[job_id] = body
+                    yield f"event: job\ndata: {body}\n\n"
+                pending |= job["status"] not in ("done", "failed")
+            if not pending:
+                yield "event: end\ndata: {}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                return
+            yield ": keep-alive\n\n"
+            time.sleep(JOB_EVENTS_INTERVAL)
+
+    # url_for in job_view needs the request context while the generator runs
+    return app.response_class(stream_with_context(stream()), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/bundle")
+def jobs_bundle():
+    """ZIP of the outputs of up to 50 finished jobs (?ids=a,b,c), as the page's "Download all"."""
+    ids = [i for i in request.args.get("ids", "").split(",") if i][:50]
+    if not ids:
+        abort(400)
+    jobs = get_jobs(ids)
+    return serve_bundle([jobs[i] for i in ids if i in jobs], "edutap-shorts.zip")
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_view(job))
+
+@app.post("/batch")
+def batch():
+    """
+    Queue a manifest (JSON array, {"items": [...]} or JSON Lines) of {source, caption,
+    design, format?, id?} items. Returns 202 with the job ids and a Location to poll
+    (/batch/<id>). With ?wait=1 it instead streams NDJSON: a header line, one line per item
+    as it finishes, then a summary; that holds a server thread for the whole batch.
+    """
+    if (request.content_length or 0) > BATCH_MAX_BYTES:
+        return jsonify(error="manifest too large"), 413
+    try:
+        raw = parse_manifest(request.get_data(as_text=True))
+        items = [batch_item(it, i) for i, it in enumerate(raw)]
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    max_items = min(BATCH_MAX_ITEMS, CLIENT_MAX_JOBS)
+    if not items or len(items) > max_items:
+        return jsonify(error=f"a batch takes 1 to {max_items} items"), 400
+    client = client_id()
+    misses = [it for it in items if not render_cache_peek(it["source"], it["text"], it["design"], it["format"])]
+    cost = sum(predict_cost(None, it["design"], it["format"]) for it in misses)
+    busy = admit(client, len(misses), cost) if misses else None   # hits are done on submit
+    if busy:
+        return too_busy(*busy)
+    batch_id = submit_batch(items, client)
+    if request.args.get("wait") != "1":
+        resp = jsonify(batch=batch_id, jobs=get_batch(batch_id)["jobs"])
+        resp.status_code = 202
+        resp.headers["Location"] = url_for("batch_status", batch_id=batch_id)
+        return resp
+
+    def stream():
+        refs = get_batch(batch_id)["refs"]
+        yield json.dumps({"batch": batch_id, "items": len(items)}) + "\n"
+        failed = 0
+        for i, job in iter_batch_results(batch_id):
+            failed += job["status"] != "done"
+            view = job_view(job) if "created" in job else job
+            yield json.dumps({"item": i, "ref": refs[i], **view}) + "\n"
+        yield json.dumps({"batch": batch_id, "done": len(items) - failed, "failed": failed,
+                          "bundle": url_for("batch_bundle", batch_id=batch_id)}) + "\n"
+
+    return app.response_class(stream_with_context(stream()), mimetype="application/x-ndjson",
+                              headers={"X-Accel-Buffering": "no"})
+
+@app.get("/batch/<batch_id>")
+def batch_status(batch_id):
+    b = get_batch(batch_id)
+    if b is None:
+        abort(404)
+    jobs = [(i, get_job(job_id)) for i, job_id in enumerate(b["jobs"])]
+    return jsonify(batch=batch_id, bundle=url_for("batch_bundle", batch_id=batch_id),
+                   jobs=[{"item": i, "ref": b["refs"][i], **job_view(job)} for i, job in jobs if job])
+
+@app.get("/batch/<batch_id>/bundle")
+def batch_bundle(batch_id):
+    """Every finished output of a batch as one stored ZIP, streamed (409 until all items are finished)."""
+    b = get_batch(batch_id)
+    if b is None:
+        abort(404)
+    jobs = get_jobs(b["jobs"])
+    return serve_bundle([jobs[j] for j in b["jobs"] if j in jobs], f"batch-{batch_id}.zip")
 
 @app.get("/download/<path:filename>")
 def download(filename):
-    return send_from_directory(OUTPUTS_DIR, filename, as_attachment=True)
+    return serve_output(filename, inline=False)
+
+@app.get("/preview/<path:filename>")
+def preview(filename):
+    """Same file, inline, so the browser's player can scrub it with Range requests."""
+    return serve_output(filename, inline=True)
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(batch_cli(sys.argv[2:]))
+    if WARM_UP:
+        warm_up()
+    start_background()
+    if sys.argv[1:2] == ["worker"]:
+        # render-only process: its threads pull from JOB_DB like the web workers'
+        threading.Event().wait()
     # local dev
     app.run(host="127.0.0.1", port=5000, debug=False, use_reloader=False)
@@ -0,0 +1,297 @@
+# bench.py — EduTap Shorts benchmarks (run locally, not part of the web app)
+#
+#   python bench.py captions [-n 5000]     caption rendering micro-benchmark
+#   python bench.py pipeline [--quick] [-o results.json] [--compare baseline.json]
+#                                          end-to-end compose_full / compose_mid runs
+#   python bench.py coldstart [--repeat 3] time from launching gunicorn to its first finished
+#                                          render, with and without the pre-fork warm-up
+#
+# Pipeline cases run on synthetic clips (lavfi testsrc2 + sine) generated once into
+# CACHE_DIR/bench. Every case runs in a fresh interpreter so its peak RSS and CPU time
+# (ours and ffmpeg's, via RUSAGE_CHILDREN) are its own.
+# The "legacy" caption path below is the pre-cache implementation (font loaded from
+# disk per caption, O(words²) prefix measuring, every line measured twice), kept here
+# only so the speedup stays measurable.
+
+from __future__ import annotations
+import argparse, json, os, random, resource, shutil, socket, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+import requests
+
+from PIL import Image, ImageDraw, ImageFont
+
+import app
+
+WORDS = ("the quick brown fox jumps over lazy dog exam preparation banking RBI grade B "
+         "SEBI NABARD current affairs economy finance policy repo rate inflation target "
+         "monetary committee notes practice questions revision").split()
+
+def sample_captions(n: int, seed: int = 7) -> list[str]:
+    """Mixed-length captions: one word up to paragraph-sized text."""
+    rnd = random.Random(seed)
+    lengths = [1, 3, 8, 15, 30, 60, 120]
+    return [" ".join(rnd.choice(WORDS) for _ in range(rnd.choice(lengths))) for _ in range(n)]
+
+# -------------------- legacy caption path (baseline) --------------------
+def _legacy_render(text: str, *, max_width=1000, font_size=52, line_height=1.35, pad_x=18, pad_y=10, radius=8):
+    font = ImageFont.truetype(str(app.FONTS_DIR / "Poppins-SemiBold.ttf"), size=font_size)
+    dr = ImageDraw.Draw(Image.new("RGBA", (10, 10), (0, 0, 0, 0)))
+    lines, curr = [], ""
+    for w in text.split():
+        test = (curr + " " + w).strip()
+        if dr.textlength(test, font=font) <= max_width or not curr:
+            curr = test
+        else:
+            lines.append(curr); curr = w
+    lines = lines + [curr] if curr else (lines or [""])
+    ascent, descent = font.getmetrics()
+    line_px = int((ascent + descent) * line_height)
+    text_w = max(int(dr.textlength(ln, font=font)) for ln in lines)
+    box_w, box_h = text_w + pad_x * 2, line_px * len(lines) + pad_y * 2
+    img = Image.new("RGBA", (box_w, box_h), (0, 0, 0, 0))
+    dr2 = ImageDraw.Draw(img)
+    dr2.rounded_rectangle((0, 0, box_w, box_h), radius, fill=(255, 255, 255, 255))
+    y = pad_y
+    for ln in lines:
+        x = (box_w - int(dr2.textlength(ln, font=font))) // 2
+        dr2.text((x, y), ln, font=font, fill=(0, 0, 0, 255))
+        y += line_px
+    return img
+
+def _time_captions(fn, captions) -> float:
+    t0 = time.perf_counter()
+    for text in captions:
+        fn(text, **app.CAPTION_STYLE)
+    return time.perf_counter() - t0
+
+def bench_captions(args):
+    captions = sample_captions(args.n)
+    legacy = _time_captions(_legacy_render, captions)
+    current = _time_captions(app.render_caption_image, captions)
+    print(f"captions: {len(captions)} mixed-length")
+    print(f"  legacy : {legacy:8.3f}s  {len(captions)/legacy:9.1f} captions/s")
+    print(f"  current: {current:8.3f}s  {len(captions)/current:9.1f} captions/s")
+    print(f"  speedup: {legacy/current:.2f}x")
+
+# -------------------- pipeline --------------------
+BENCH_DIR = app.CACHE_DIR / "bench"
+
+# (name, width, height, fps, seconds, rotation): rotation is written as display-matrix
+# metadata (a phone clip stored landscape, shown portrait)
+CLIPS = [
+    ("720p30-landscape", 1280, 720, 30, 10, 0),
+    ("1080p30-landscape", 1920, 1080, 30, 10, 0),
+    ("1080p60-landscape", 1920, 1080, 60, 10, 0),
+    ("1080p30-portrait", 1080, 1920, 30, 10, 0),
+    ("720p25-square", 720, 720, 25, 10, 0),
+    ("360p30-long", 640, 360, 30, 60, 0),
+    ("2160p30-landscape", 3840, 2160, 30, 10, 0),
+    ("2160p30-rotated", 3840, 2160, 30, 10, 90),
+]
+QUICK_CLIPS = ("720p30-landscape", "1080p30-portrait", "2160p30-landscape")
+CAPTIONS = {
+    "word": "Revision",
+    "sentence": "RBI Grade B: five monetary policy facts to revise tonight",
+    "paragraph": " ".join(WORDS * 2),
+}
+DESIGNS = ("full", "mid")
+
+def clip_path(name: str) -> Path:
+    """Synthetic source for CLIPS[name], generated on first use."""
+    _, w, h, fps, seconds, rotation = next(c for c in CLIPS if c[0] == name)
+    path = BENCH_DIR / f"{name}.mp4"
+    if not path.exists():
+        BENCH_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-y",
+                        "-f", "lavfi", "-i", f"testsrc2=size={w}x{h}:rate={fps}:duration={seconds}",
+                        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+                        "-c:a", "aac", "-shortest", str(tmp)], check=True)
+        if rotation:
+            rotated = path.with_suffix(".rot.mp4")
+            subprocess.run(["ffmpeg", "-v", "error", "-y", "-display_rotation:v:0", str(rotation),
+                            "-i", str(tmp), "-c", "copy", str(rotated)], check=True)
+            os.replace(rotated, tmp)
+        os.replace(tmp, path)
+    return path
+
+def pipeline_cases(quick: bool) -> list[dict]:
+    """Every clip x design with a one-line caption, plus a caption-length sweep on the first clip."""
+    clips = [c[0] for c in CLIPS if not quick or c[0] in QUICK_CLIPS]
+    cases = [{"clip": c, "design": d, "caption": "sentence"} for c in clips for d in DESIGNS]
+    cases += [{"clip": clips[0], "design": d, "caption": cap}
+              for d in DESIGNS for cap in CAPTIONS if cap != "sentence"]
+    for case in cases:
+        case["id"] = f'{case["clip"]}/{case["design"]}/{case["caption"]}'
+    return cases
+
+def run_case(case: dict) -> dict:
+    """One render, in this process: per-stage wall times, CPU, peak RSS and output size."""
+    src = str(clip_path(case["clip"]))
+    out = BENCH_DIR / "out.mp4"
+    timings: dict[str, float] = {}
+    self0, kids0 = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    with app.stage(timings, "caption"):
+        caption = app.render_caption_image(CAPTIONS[case["caption"]], **app.CAPTION_STYLE)
+    compose = app.compose_mid if case["design"] == "mid" else app.compose_full
+    compose(src, caption, out, str(app.LOGO_PATH), timings=timings)
+    wall = time.perf_counter() - t0
+    self1, kids1 = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    size = out.stat().st_size
+    out.unlink()
+    return {
+        "wall_s": wall,
+        "cpu_s": (self1.ru_utime - self0.ru_utime + self1.ru_stime - self0.ru_stime
+                  + kids1.ru_utime - kids0.ru_utime + kids1.ru_stime - kids0.ru_stime),
+        "rss_peak_mb": self1.ru_maxrss / 1024,          # this interpreter (Pillow, caption buffers)
+        "ffmpeg_rss_peak_mb": kids1.ru_maxrss / 1024,   # largest child: the ffmpeg encode
+        "output_bytes": size,
+        "stages": timings,
+    }
+
+def _median_run(runs: list[dict]) -> dict:
+    best = sorted(runs, key=lambda r: r["wall_s"])[len(runs) // 2]
+    return {**best, "wall_s_runs": [round(r["wall_s"], 3) for r in runs]}
+
+def bench_pipeline(args):
+    cases = pipeline_cases(args.quick)
+    for case in cases:
+        clip_path(case["clip"])   # generate outside the timed runs
+    results = {}
+    for case in cases:
+        runs = []
+        for _ in range(args.repeat):
+            proc = subprocess.run([sys.executable, __file__, "case", json.dumps(case)],
+                                  check=True, capture_output=True, text=True)
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        results[case["id"]] = r = _median_run(runs)
+        print(f'{case["id"]:42s} {r["wall_s"]:7.2f}s wall {r["cpu_s"]:7.2f}s cpu '
+              f'{r["ffmpeg_rss_peak_mb"]:6.0f}MB ffmpeg {r["output_bytes"] / 1e6:6.2f}MB out')
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"cpus": app.CPU_COUNT, "encoder_profile": app.ENCODER_PROFILE,
+                 "ffmpeg": subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.split("\n")[0]},
+        "repeat": args.repeat,
+        "cases": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.output}")
+    if args.compare:
+        sys.exit(compare_results(json.loads(Path(args.compare).read_text()), report, args.threshold))
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> int:
+    """Print per-case ratios against a baseline; returns 1 if any case regressed beyond threshold."""
+    regressed = 0
+    print(f'\n{"case":42s} {"wall":>8s} {"cpu":>8s} {"size":>8s}')
+    for case_id, now in current["cases"].items():
+        then = baseline["cases"].get(case_id)
+        if then is None:
+            print(f"{case_id:42s} (not in baseline)")
+            continue
+        ratios = {k: now[k] / then[k] if then[k] else 1.0 for k in ("wall_s", "cpu_s", "output_bytes")}
+        slow = ratios["wall_s"] > 1 + threshold or ratios["cpu_s"] > 1 + threshold
+        regressed |= slow
+        print(f'{case_id:42s} {ratios["wall_s"]:7.2f}x {ratios["cpu_s"]:7.2f}x {ratios["output_bytes"]:7.2f}x'
+              + ("  REGRESSION" if slow else ""))
+    geo = statistics.geometric_mean([now["wall_s"] / baseline["cases"][k]["wall_s"]
+                                     for k, now in current["cases"].items() if k in baseline["cases"]] or [1.0])
+    print(f"overall wall: {geo:.2f}x baseline (geometric mean)")
+    return 1 if regressed else 0
+
+def bench_case(args):
+    print(json.dumps(run_case(json.loads(args.case))))
+
+# -------------------- cold start --------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_until(check, timeout: float = 120):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError("gunicorn did not answer in time")
+
+def coldstart_run(clip: Path, warm: bool, drop_caches: bool = False) -> dict:
+    """Launch gunicorn on empty caches, upload one clip as soon as it listens, and time it all."""
+    tmp = Path(tempfile.mkdtemp(prefix="coldstart_", dir=BENCH_DIR))
+    if drop_caches:   # a fresh container: interpreter, libraries and ffmpeg come off disk (root only)
+        os.sync()
+        Path("/proc/sys/vm/drop_caches").write_text("3\n")
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "WARM_UP": "1" if warm else "0", "CACHE_DIR": str(tmp / "cache"),
+           "OUTPUTS_DIR": str(tmp / "outputs"), "PORT": str(port)}
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "app:app"],
+                            cwd=app.APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until(lambda: requests.get(base + "/", timeout=5).ok)
+        listening = time.perf_counter()
+        with open(clip, "rb") as f:
+            r = requests.post(base + "/render", headers={"Accept": "application/json"},
+                              data={"design": "full", "total_items": "1", "mode_0": "upload", "text_0": "Cold start"},
+                              files={"file_0": (clip.name, f, "video/mp4")}, timeout=60)
+        r.raise_for_status()
+        job_url = base + "/jobs/" + r.json()["jobs"][0]["id"]
+        _wait_until(lambda: requests.get(job_url, timeout=5).json()["status"] in ("done", "failed"), timeout=600)
+        done = time.perf_counter()
+        job = requests.get(job_url, timeout=5).json()
+        if job["status"] != "done":
+            raise RuntimeError(f"cold-start render failed: {job['error']}")
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"listening_s": listening - t0, "first_render_s": done - t0, "request_to_done_s": done - listening,
+            "stages": job["timings"]}
+
+def bench_coldstart(args):
+    clip = clip_path(args.clip)
+    report = {}
+    for warm in (True, False):
+        runs = [coldstart_run(clip, warm, args.drop_caches) for _ in range(args.repeat)]
+        r = sorted(runs, key=lambda r: r["first_render_s"])[len(runs) // 2]
+        report["warm" if warm else "cold"] = r
+        stages = " ".join(f"{k}={v:.3f}" for k, v in r["stages"].items())
+        print(f'{"warm-up" if warm else "no warm-up":11s} listening {r["listening_s"]:6.2f}s  '
+              f'first render done {r["first_render_s"]:6.2f}s  (request to done {r["request_to_done_s"]:6.2f}s)  {stages}')
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="EduTap Shorts benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("captions", help="caption rendering micro-benchmark")
+    p.add_argument("-n", type=int, default=5000, help="number of captions (default 5000)")
+    p.set_defaults(func=bench_captions)
+    p = sub.add_parser("pipeline", help="end-to-end render benchmark on synthetic clips")
+    p.add_argument("--quick", action="store_true", help="three clips instead of the full matrix")
+    p.add_argument("--repeat", type=int, default=3, help="runs per case; the median is reported (default 3)")
+    p.add_argument("-o", "--output", default="bench-results.json", help="JSON report path")
+    p.add_argument("--compare", metavar="BASELINE", help="compare against a saved report; exits 1 on regression")
+    p.add_argument("--threshold", type=float, default=0.10, help="regression threshold (default 0.10 = 10%%)")
+    p.set_defaults(func=bench_pipeline)
+    p = sub.add_parser("coldstart", help="time to first render from a fresh gunicorn, with and without warm-up")
+    p.add_argument("--clip", default="720p30-landscape", help="source clip (a CLIPS name)")
+    p.add_argument("--repeat", type=int, default=3, help="runs each way; the median is reported (default 3)")
+    p.add_argument("--drop-caches", action="store_true", help="drop the page cache before each run (needs root)")
+    p.add_argument("-o", "--output", help="also write the numbers as JSON")
+    p.set_defaults(func=bench_coldstart)
+    p = sub.add_parser("case", help="run a single pipeline case given as JSON (used by `pipeline`)")
+    p.add_argument("case")
+    p.set_defaults(func=bench_case)
+    args = ap.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
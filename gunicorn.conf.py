@@ -0,0 +1,21 @@
+# gunicorn.conf.py — read by gunicorn from the working directory (Procfile, Dockerfile)
+#
+# The app is imported and warmed once in the master (app.warm_up: ffmpeg check, fonts,
+# caption caches, logo plate), then forked, so workers start with all of it in memory
+# (shared copy-on-write). Each worker starts its own threads after the fork. With
+# preload_app a code change needs a full restart; HUP only replaces the workers.
+# Workers come from WEB_CONCURRENCY and the bind address from PORT (gunicorn's defaults).
+import os
+
+preload_app = True
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 300
+
+def on_starting(server):
+    import app
+    if app.WARM_UP:
+        app.warm_up()
+
+def post_worker_init(worker):
+    import app
+    app.start_background()
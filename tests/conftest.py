@@ -0,0 +1,10 @@
+# The app configures itself from the environment at import, so point its directories and
+# job store at a scratch location (and start no render threads) before it's imported.
+import os, sys, tempfile
+from pathlib import Path
+
+_scratch = Path(tempfile.mkdtemp(prefix="edutap-tests-"))
+os.environ.update(OUTPUTS_DIR=str(_scratch / "outputs"), CACHE_DIR=str(_scratch / "cache"),
+                  SPOOL_DIR=str(_scratch / "spool"), JOB_WORKERS="0", WARM_UP="0")
+os.environ.pop("JOB_DB", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
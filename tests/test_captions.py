@@ -0,0 +1,21 @@
+import pytest
+
+import app
+
+SALAM = "\u0633\u0644\u0627\u0645"   # salam: seen, lam, alef, meem
+
+
+@pytest.mark.skipif(app.HAS_RAQM, reason="raqm shapes inside Pillow; runs go in unchanged")
+def test_arabic_is_shaped_and_reordered_without_raqm():
+    # joined presentation forms in visual order: isolated meem, lam-alef ligature, initial seen
+    assert app._shape(SALAM) == "\ufee1\ufefc\ufeb3"
+
+
+def test_latin_runs_are_left_alone():
+    assert app._shape("Hello") == "Hello"
+
+
+@pytest.mark.skipif(app.HAS_RAQM, reason="nothing to warn about")
+def test_warns_without_raqm(caplog):
+    app._warn_shaping()
+    assert any(r.levelname == "WARNING" and "raqm" in r.getMessage() for r in caplog.records)
@@ -0,0 +1,160 @@
+import os, re, threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import app
+
+BODY = os.urandom(3 << 20)
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    A file host: Range and an ETag on /ranged/*, neither on /plain/*. Ranges in `fail` get a
+    503, and ranges in `fail_once` get one; a path in `drop_once` has its next whole-file
+    response cut short, and one in `no_range` answers every Range with the whole file.
+    """
+    requests: list[tuple[str, str]] = []
+    fail: set[str] = set()
+    fail_once: set[str] = set()
+    drop_once: set[str] = set()
+    no_range: set[str] = set()
+
+    def do_GET(self):
+        rng = self.headers.get("Range", "")
+        StandIn.requests.append((self.path, rng))
+        ranged = self.path.startswith("/ranged/")
+        m = re.fullmatch(r"bytes=(\d+)-(\d*)", rng) if ranged and self.path not in StandIn.no_range else None
+        if m:
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else len(BODY) - 1
+            if rng in StandIn.fail or rng in StandIn.fail_once:
+                StandIn.fail_once.discard(rng)
+                self.send_error(503)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(BODY)}")
+        else:
+            start, end = 0, len(BODY) - 1
+            self.send_response(200)
+        body = BODY[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        if ranged:
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if self.path in StandIn.drop_once and not m:
+            StandIn.drop_once.discard(self.path)
+            body = body[:len(body) // 3]   # connection drops a third of the way in
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def host(monkeypatch):
+    StandIn.requests, StandIn.fail, StandIn.fail_once = [], set(), set()
+    StandIn.drop_once, StandIn.no_range = set(), set()
+    monkeypatch.setattr(app, "RANGE_MIN_BYTES", 1 << 20)
+    monkeypatch.setattr(app, "RANGE_CHUNK", 1 << 20)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def _ranges():
+    return sorted(r for _, r in StandIn.requests if r)
+
+
+def test_ranged_download_is_parallel_and_cached(host):
+    url = f"{host}/ranged/a.mp4"
+    path = app._download_source(url)
+    assert Path(path).read_bytes() == BODY
+    assert _ranges() == ["bytes=0-1048575", "bytes=1048576-2097151", "bytes=2097152-3145727"]
+    StandIn.requests.clear()
+    assert app._download_source(url) == path   # a repeat link is served from the cache
+    assert StandIn.requests == []
+
+
+def test_ranged_download_resumes_missing_chunks(host):
+    url = f"{host}/ranged/b.mp4"
+    StandIn.fail = {"bytes=1048576-2097151"}
+    with pytest.raises(app.requests.HTTPError, match="HTTP 503"):
+        app._download_source(url)
+    StandIn.requests.clear()
+    StandIn.fail = set()
+    assert Path(app._download_source(url)).read_bytes() == BODY
+    assert _ranges() == ["bytes=1048576-2097151"]   # only the chunk that failed is fetched again
+
+
+def test_ranged_download_retries_a_busy_chunk(host):
+    url = f"{host}/ranged/d.mp4"
+    StandIn.fail_once = {"bytes=1048576-2097151"}
+    assert Path(app._download_source(url)).read_bytes() == BODY
+    assert _ranges().count("bytes=1048576-2097151") == 2
+
+
+def test_single_stream_resumes_after_a_drop(host, monkeypatch):
+    monkeypatch.setattr(app, "RANGE_MIN_BYTES", 1 << 30)   # one connection, resumed with Range
+    url = f"{host}/ranged/c.mp4"
+    StandIn.drop_once = {"/ranged/c.mp4"}
+    assert Path(app._download_source(url)).read_bytes() == BODY
+    assert _ranges() == [f"bytes={len(BODY) // 3}-"]
+
+
+def test_single_stream_resumes_a_part_left_by_an_earlier_attempt(host, monkeypatch):
+    monkeypatch.setattr(app, "RANGE_MIN_BYTES", 1 << 30)
+    url = f"{host}/ranged/e.mp4"
+    part = app._PARTIAL_DIR / (app.hashlib.sha1(url.encode()).hexdigest() + ".part")
+    part.parent.mkdir(parents=True, exist_ok=True)
+    part.write_bytes(BODY[:1000])   # a worker was restarted mid-download
+    part.with_suffix(".json").write_text('{"stream": true, "validator": "\\"v1\\""}')
+    assert Path(app._download_source(url)).read_bytes() == BODY
+    assert _ranges() == ["bytes=1000-"]
+    assert not part.with_suffix(".json").exists()
+
+
+def test_single_stream_refuses_a_resume_without_206(host, monkeypatch):
+    monkeypatch.setattr(app, "RANGE_MIN_BYTES", 1 << 30)
+    url = f"{host}/ranged/f.mp4"
+    StandIn.drop_once, StandIn.no_range = {"/ranged/f.mp4"}, {"/ranged/f.mp4"}
+    with pytest.raises(RuntimeError, match="got HTTP 200"):
+        app._download_source(url)
+
+
+def test_same_content_under_two_links_is_cached_once(host):
+    a = app._download_source(f"{host}/plain/x.mp4")
+    b = app._download_source(f"{host}/ranged/y.mp4")
+    assert a == b and Path(a).name == f"{app.file_digest(a)}.mp4"
+
+
+
+class InlinePool:
+    """Runs each download in the caller, so it has already failed when its callbacks are added."""
+    def submit(self, fn, *args):
+        fut = Future()
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+
+def test_refused_link_fails_without_holding_the_source_lock(monkeypatch):
+    monkeypatch.setattr(app, "_source_downloads", InlinePool)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    url = f"http://127.0.0.1:{server.server_port}/plain/gone.mp4"
+    server.server_close()   # nothing listens there now: the connection is refused
+    futures = []
+    caller = threading.Thread(target=lambda: futures.append(app.prefetch_source(url)), daemon=True)
+    caller.start()
+    caller.join(10)
+    assert futures, "prefetch_source deadlocked"
+    assert isinstance(futures[0].exception(), app.requests.ConnectionError)
+    assert not app._source_lock.locked() and url not in app._source_inflight
@@ -0,0 +1,10 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("cap_h", [101, 102])
+def test_full_layout_keeps_the_video_on_even_rows(cap_h):
+    layout = app.layout_full((800, cap_h), app.LOGO_PATH)
+    assert layout["video_top"] % 2 == 0 and layout["available_h"] % 2 == 0
+    assert layout["video_top"] >= layout["caption_y"] + cap_h + 40
@@ -0,0 +1,15 @@
+import json, logging
+
+import app
+
+
+def test_render_job_summary_is_logged(caplog):
+    # no caplog.set_level: the record has to get past the app's own configured level
+    job = app._new_job("clip.mp4", "Hello", "full")
+    job.update(status="done", started=job["created"], timings={"probe": 0.01, "encode": 1.5})
+    app.log_render_job(job, "done")
+    records = [r for r in caplog.records if r.name == app.app.logger.name and r.levelno == logging.INFO]
+    assert records, "render summary was dropped"
+    line = json.loads(records[-1].getMessage())
+    assert line["event"] == "render_job" and line["result"] == "done"
+    assert line["stages"] == {"probe": 0.01, "encode": 1.5}
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import app
+
+BODY = os.urandom(100_000)
+
+
+@pytest.fixture
+def client():
+    (app.OUTPUTS_DIR / "clip.mp4").write_bytes(BODY)
+    app.output_register("clip.mp4")
+    yield app.app.test_client()
+    app.output_forget("clip.mp4")
+    (app.OUTPUTS_DIR / "clip.mp4").unlink(missing_ok=True)
+
+
+def test_full_download(client):
+    r = client.get("/download/clip.mp4")
+    assert r.status_code == 200 and r.data == BODY
+    assert r.headers["Accept-Ranges"] == "bytes" and r.headers["ETag"]
+    assert r.headers["Content-Disposition"].startswith("attachment")
+
+
+def test_range(client):
+    r = client.get("/download/clip.mp4", headers={"Range": "bytes=1000-1999"})
+    assert r.status_code == 206 and r.data == BODY[1000:2000]
+    assert r.headers["Content-Range"] == f"bytes 1000-1999/{len(BODY)}"
+    assert r.headers["Content-Length"] == "1000"
+
+
+def test_unsatisfiable_range(client):
+    r = client.get("/download/clip.mp4", headers={"Range": f"bytes={len(BODY)}-"})
+    assert r.status_code == 416
+    assert r.headers["Content-Range"] == f"bytes */{len(BODY)}"
+
+
+def test_if_none_match(client):
+    etag = client.head("/download/clip.mp4").headers["ETag"]
+    assert client.get("/download/clip.mp4", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_if_range(client):
+    etag = client.head("/preview/clip.mp4").headers["ETag"]
+    same = client.get("/preview/clip.mp4", headers={"Range": "bytes=0-99", "If-Range": etag})
+    assert same.status_code == 206 and same.data == BODY[:100]
+    changed = client.get("/preview/clip.mp4", headers={"Range": "bytes=0-99", "If-Range": '"stale"'})
+    assert changed.status_code == 200 and changed.data == BODY   # the file changed: send all of it
+    assert changed.headers["Content-Disposition"].startswith("inline")
+
+
+def test_missing_output(client):
+    assert client.get("/download/nope.mp4").status_code == 404
@@ -0,0 +1,57 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _part(name: str, value: bytes, filename: str = "") -> bytes:
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return f"--xyz\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+
+
+def _post(client, body: bytes):
+    return client.post("/render", data=body, content_type="multipart/form-data; boundary=xyz",
+                       headers={"Accept": "application/json"})
+
+
+def test_truncated_upload(client):
+    body = _part("text_0", b"hello") + _part("file_0", b"x" * 5000, "a.mp4")[:-2]   # cut off mid-file
+    before = set(app.SPOOL_DIR.iterdir())
+    r = _post(client, body)
+    assert r.status_code == 400 and r.headers["Connection"] == "close"
+    assert r.json["jobs"] == [] and "truncated" in r.json["error"]
+    assert set(app.SPOOL_DIR.iterdir()) == before   # the part in progress left no temp dir
+
+
+def test_form_field_after_the_items(client):
+    body = (_part("mode_0", b"link") + _part("link_0", b"http://example.com/a.mp4") + _part("text_0", b"hi")
+            + _part("design", b"mid") + b"--xyz--\r\n")
+    r = _post(client, body)
+    assert r.headers["Connection"] == "close" and "design came after the items" in r.json["error"]
+    [job] = r.json["jobs"]   # queued before the late field arrived, with the design it had then
+    assert job["design"] == "full"
+
+
+def test_link_must_be_http(client, tmp_path):
+    local = tmp_path / "long.mp4"
+    local.write_bytes(b"not checked")
+    body = _part("mode_0", b"link") + _part("link_0", str(local).encode()) + _part("text_0", b"hi") + b"--xyz--\r\n"
+    r = _post(client, body)
+    assert r.status_code == 400 and r.json["jobs"] == []
+    assert r.json["refused"] == [{"item": 0, "error": "source must be an http(s) link", "status": 400}]
+
+
+def test_cards_past_the_limit_are_refused(client, monkeypatch):
+    monkeypatch.setattr(app, "FORM_MAX_ITEMS", 2)
+    body = b"".join(_part(f"mode_{i}", b"link") + _part(f"link_{i}", f"http://example.com/{i}.mp4".encode())
+                    + _part(f"text_{i}", b"hi") for i in range(2))
+    body += b"".join(_part(f"text_{i}", b"hi") + _part(f"file_{i}", b"x" * 5000, "a.mp4") for i in (2, 3))
+    before = set(app.SPOOL_DIR.iterdir())
+    r = _post(client, body + b"--xyz--\r\n")
+    assert r.status_code == 202 and len(r.json["jobs"]) == 2
+    assert r.json["refused"] == [{"item": i, "error": "at most 2 items per form", "status": 413} for i in (2, 3)]
+    assert set(app.SPOOL_DIR.iterdir()) == before   # their uploads were never spooled